@@ -1,30 +1,81 @@
 # fichier: arbre_des_causes_app.py
-import os
-from io import BytesIO
-from collections import defaultdict, deque
+import json
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
-import graphviz
-from docx import Document  # python-docx
-
-# =============== CONSTANTES ===============
-CATEGORIES = {
-    "ORGANISATIONNELLE": {"color": "#5B9BD5", "desc": "Bleu soutenu"},
-    "HUMAINE": {"color": "#ED7D31", "desc": "Orange soutenu"},
-    "TECHNIQUE": {"color": "#A6A6A6", "desc": "Gris soutenu"},
-}
-RANKDIR = "RL"               # racine à droite -> causes à gauche
-ARROW_MODE = "PARENT_TO_CHILD"  # flèches Parent -> Enfant
+
+from arbre_des_causes_core import (
+    CATEGORIES,
+    NEAR_DUP_THRESHOLD,
+    PROFILE_ENABLED,
+    SUMMARY_PREFIX,
+    InvestigationDB,
+    NodeSearchIndex,
+    QuestionCache,
+    QuestionDetector,
+    RenderCache,
+    TreeLabelIndex,
+    TreeStore,
+    ai_questions_chunked,
+    ai_questions_stream,
+    build_lod_view,
+    current_profile,
+    detect_questions_from_text,
+    export_arbre_docx,
+    export_why_docx,
+    extract_docx_text,
+    finish_profile,
+    get_ai_queue,
+    get_heuristic_engine,
+    parse_tree_import,
+    start_profile,
+)
+
+LOD_AUTO_THRESHOLD = 300     # au-delà : affichage par niveau proposé par défaut
+EXPORT_ASYNC_THRESHOLD = 1000  # au-delà : export Word en tâche de fond
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PROFILE_HISTORY = 50         # exécutions conservées dans le panneau de profilage
+NODE_PICKER_PAGE = 50        # options envoyées au navigateur par sélecteur de nœud
+INVESTIGATIONS_PAGE = 20     # enquêtes listées par page dans la barre latérale
+
+# Profilage : toujours actif avec ARBRE_PROFILE=1 (journal « arbre.profile »),
+# sinon activable par session depuis le panneau d'administration (?admin=1).
+def profiling_wanted() -> bool:
+    return PROFILE_ENABLED or st.session_state.get("prof_enabled", False)
+
+def record_profile(finished):
+    if finished is not None:
+        st.session_state.prof_history = (st.session_state.get("prof_history", []) + [finished.to_dict()])[-PROFILE_HISTORY:]
+
+prof = start_profile(profiling_wanted())
+st.session_state.full_run = True    # False entre deux exécutions complètes : réexécution d'un fragment
+
+# =============== RESSOURCES PARTAGÉES (toutes sessions) ===============
+@st.cache_resource
+def get_render_cache() -> RenderCache:
+    return RenderCache()
+
+@st.cache_resource
+def get_question_cache() -> QuestionCache:
+    return QuestionCache()
+
+@st.cache_resource
+def get_investigation_db() -> InvestigationDB:
+    return InvestigationDB()
+
+@st.cache_resource
+def get_export_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="export")
 
 # =============== ETATS INITIAUX ===============
+prof.phase("init")
 if "page" not in st.session_state:
     st.session_state.page = "Arbre des causes"
 
-# Arbre des causes
-if "nodes" not in st.session_state:
-    st.session_state.nodes = {"root": {"label": "Racine", "category": None}}
-if "edges" not in st.session_state:
-    st.session_state.edges = []
+# Arbre des causes (nœuds + liens Parent -> Enfant, indexés)
+if "tree" not in st.session_state:
+    st.session_state.tree = TreeStore()
 if "root_label" not in st.session_state:
     st.session_state.root_label = "Racine"
 
@@ -34,6 +85,12 @@ if "why" not in st.session_state:
 if "why_problem" not in st.session_state:
     st.session_state.why_problem = ""
 
+# Visualisation par niveau : branches dépliées / repliées manuellement
+if "viz_expanded" not in st.session_state:
+    st.session_state.viz_expanded = set()
+if "viz_collapsed" not in st.session_state:
+    st.session_state.viz_collapsed = set()
+
 # Assistant IA (texte d’entrée + sortie textuelle, + sélection)
 if "ai_doc_text" not in st.session_state:
     st.session_state.ai_doc_text = ""
@@ -42,196 +99,304 @@ if "ai_questions_text" not in st.session_state:
 if "ai_detected_questions" not in st.session_state:
     st.session_state.ai_detected_questions = []  # liste des questions extraites du bloc texte
 
+# Enquête enregistrée (None = non enregistrée) + dernières valeurs écrites en base
+if "inv_id" not in st.session_state:
+    st.session_state.inv_id = None
+if "inv_synced" not in st.session_state:
+    st.session_state.inv_synced = {}
+
 # =============== HELPERS GLOBAUX ===============
 def get_parent(node_id: str):
-    for src, tgt in st.session_state.edges:
-        if tgt == node_id:
-            return src
-    return None
-
-def build_children_map(edges):
-    children = defaultdict(list)
-    for src, tgt in edges:
-        children[src].append(tgt)
-    return children
+    return st.session_state.tree.parent(node_id)
 
 def is_descendant(root_id: str, query_id: str) -> bool:
     """True si query_id est dans le sous-arbre de root_id (Parent->Enfant)."""
-    children = build_children_map(st.session_state.edges)
-    q = deque([root_id])
-    while q:
-        n = q.popleft()
-        if n == query_id:
-            return True
-        q.extend(children.get(n, []))
-    return False
-
-def export_arbre_docx(title, nodes, edges) -> BytesIO:
-    doc = Document()
-    doc.add_heading(title or "Arbre des causes", 0)
-
-    doc.add_heading("Catégories", level=1)
-    for cat, info in CATEGORIES.items():
-        doc.add_paragraph(f"- {cat} : {info['desc']}")
-
-    doc.add_heading("Nœuds", level=1)
-    for nid, data in nodes.items():
-        label = data.get("label", "")
-        cat = data.get("category") or "Non défini"
-        doc.add_paragraph(f"- {label} ({cat})")
-
-    doc.add_heading("Liens Parent → Enfant", level=1)
-    for src, tgt in edges:
-        doc.add_paragraph(f"{nodes[src]['label']} → {nodes[tgt]['label']}")
-
-    buf = BytesIO()
-    doc.save(buf)
-    buf.seek(0)
-    return buf
-
-# -------- Extraction texte .docx (paragraphes + tableaux) --------
-def extract_docx_text(file_bytes: BytesIO) -> str:
-    doc = Document(file_bytes)
-    parts = []
-    for p in doc.paragraphs:
-        if p.text and p.text.strip():
-            parts.append(p.text.strip())
-    # tableaux -> cellules concaténées par tabulation, lignes par saut de ligne
-    for table in doc.tables:
-        for row in table.rows:
-            cells = [cell.text.strip() for cell in row.cells]
-            if any(cells):
-                parts.append("\t".join(c for c in cells if c))
-    return "\n".join(parts).strip()
-
-# -------- IA: OpenAI (questions profondes) ou heuristique locale --------
-def ai_questions_only(text: str) -> str:
-    """
-    Renvoie un seul bloc de texte (markdown simple) à copier-coller,
-    contenant des QUESTIONS d’enquête profondes, organisées par thèmes.
-    """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if api_key:
+    return st.session_state.tree.is_descendant(root_id, query_id)
+
+def investigation_fields() -> dict:
+    return {
+        "root_label": st.session_state.root_label,
+        "why_problem": st.session_state.why_problem,
+        "why": list(st.session_state.why),
+        "ai_doc_text": st.session_state.ai_doc_text,
+        "ai_questions_text": st.session_state.ai_questions_text,
+    }
+
+def set_investigation_page(page: int = 0):
+    st.session_state.inv_page = page
+
+def open_investigation(inv_id: int) -> bool:
+    """Charge une enquête dans la session (seule cette enquête est lue)."""
+    data = get_investigation_db().load(inv_id)
+    if data is None:
+        return False
+    tree = data["tree"]
+    get_investigation_db().attach(tree, inv_id)
+    st.session_state.tree = tree
+    st.session_state.root_label = data["root_label"]
+    st.session_state.why_problem = data["why_problem"]
+    st.session_state.why = data["why"]
+    st.session_state.ai_doc_text = data["ai_doc_text"]
+    st.session_state.ai_questions_text = data["ai_questions_text"]
+    st.session_state.ai_detected_questions = detect_questions_from_text(data["ai_questions_text"])
+    # oublier les widgets de l'analyse précédente (réponses 5 Pourquoi, cases IA)
+    for k in list(st.session_state):
+        k = str(k)
+        if (k.startswith("why_") and k[4:].isdigit()) or k.startswith("aiq_"):
+            del st.session_state[k]
+    st.session_state.inv_id = inv_id
+    st.session_state.inv_title = data["title"]
+    st.session_state.inv_synced = investigation_fields()
+    st.query_params["enquete"] = str(inv_id)
+    return True
+
+def save_new_investigation(title: str):
+    db = get_investigation_db()
+    inv_id = db.create(title, st.session_state.tree, **investigation_fields())
+    db.attach(st.session_state.tree, inv_id)
+    st.session_state.inv_id = inv_id
+    st.session_state.inv_title = title
+    st.session_state.inv_synced = investigation_fields()
+    st.query_params["enquete"] = str(inv_id)
+
+def sync_investigation():
+    """Écrit uniquement les champs modifiés depuis la dernière synchronisation."""
+    if st.session_state.inv_id is None:
+        return
+    current = investigation_fields()
+    synced = st.session_state.inv_synced
+    changed = {k: v for k, v in current.items() if synced.get(k) != v}
+    if changed:
+        get_investigation_db().update_fields(st.session_state.inv_id, **changed)
+        synced.update(changed)
+
+def build_tree_export(title, nodes, edges, with_image: bool):
+    """(fichier Word, avertissement) ; le schéma vient du cache de rendu."""
+    image, warning = None, None
+    if with_image:
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key)
-
-            system = (
-                "Tu es un expert HSE. Tu vas proposer UNIQUEMENT des QUESTIONS d'enquête "
-                "ouvertes, précises, actionnables, classées par thèmes. Réponds en texte clair."
-            )
-            user = f"""
-Analyse le recueil d'effets ci-dessous (accident du travail). 
-Produis un texte prêt à copier-coller (pas de JSON), avec des sections par thème et des puces.
-
-Thèmes attendus (si pertinents) :
-- Chronologie
-- Organisation
-- Humain
-- Technique
-- Environnement
-- Barrières/Contrôles
-
-Pour chaque question :
-- Formulation ouverte et précise
-- Si utile, ajoute entre parenthèses une piste de "preuves attendues" (documents/observations).
-
-Recueil d'effets:
-\"\"\"{text}\"\"\"
-"""
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "system", "content": system},
-                          {"role": "user", "content": user}],
-                temperature=0.2,
-            )
-            content = resp.choices[0].message.content
-            return content.strip()
+            image = get_render_cache().get_image(nodes, edges, "png")
         except Exception as e:
-            st.warning(f"IA OpenAI indisponible ({e}). Passage en mode local.")
-            return heuristic_questions_text(text)
-    else:
-        return heuristic_questions_text(text)
-
-def heuristic_questions_text(text: str) -> str:
-    """Fallback local: questions par thèmes (pas juste paraphrase)."""
-    lower = text.lower()
-
-    sections = []
-    chrono = [
-        "- Déroulez minute par minute l’heure qui a précédé l’événement (preuves: main courante, radios, badges).",
-        "- Quels changements de plan ont eu lieu le jour J ? Par qui et pourquoi (preuves: briefing, ordres de travail) ?",
-    ]
-    orga = [
-        "- Quelles procédures/consignations/permits étaient applicables et ont-elles été réellement suivies (preuves: permis, signatures) ?",
-        "- La charge de travail et la supervision étaient-elles adaptées (preuves: planning, entretiens) ?",
-    ]
-    humain = [
-        "- Quelles compétences/habilitations spécifiques avaient les intervenants (preuves: registres de formation) ?",
-        "- Des signes de fatigue/stress/distraction ont-ils été observés (preuves: horaires, témoignages) ?",
-    ]
-    tech = [
-        "- Quel était l’état réel des équipements (défauts connus, interlocks, maintenance) (preuves: GMAO, rapports d’essai) ?",
-        "- Quels EPI/protections étaient requis et portés/en place (preuves: consignes, photos) ?",
-    ]
-    envt = [
-        "- Conditions météo/visibilité/bruit/éclairage : quel impact (preuves: météo, mesures, photos) ?",
-        "- D’autres activités à proximité ont-elles créé des interférences (preuves: planning global) ?",
-    ]
-    barri = [
-        "- Quelles barrières (prévention/protection) étaient prévues ? Laquelle a échoué en premier (preuves: analyse risques) ?",
-        "- Quels contrôles de dernière minute ont été réalisés (LOTO, point d’arrêt, check-lists) (preuves: documents signés) ?",
-    ]
-
-    if any(k in lower for k in ["autorout", "trafic", "balisage", "signalisation"]):
-        envt.append("- Le balisage/ITPC était-il conforme (espacements, limites, visibilité) (preuves: plan balisage, photos) ?")
-        orga.append("- Les communications radio avec PC trafic/astreinte ont-elles couvert les phases clés (preuves: logs radio) ?")
-
-    sections.append(("Chronologie", chrono))
-    sections.append(("Organisation", orga))
-    sections.append(("Humain", humain))
-    sections.append(("Technique", tech))
-    sections.append(("Environnement", envt))
-    sections.append(("Barrières/Contrôles", barri))
-
-    out = []
-    for title, qs in sections:
-        out.append(f"### {title}")
-        out.extend(qs)
-        out.append("")
-    return "\n".join(out).strip()
-
-# -------- Parseur des questions (depuis le bloc texte IA) --------
-def detect_questions_from_text(text: str):
+            warning = f"Schéma non inclus ({e})."
+    return export_arbre_docx(title, nodes, edges, image=image), warning
+
+def export_status():
+    """Suivi de l'export en tâche de fond (fragment relancé tant qu'il n'est pas fini)."""
+    fut = st.session_state.get("export_future")
+    if fut is None:
+        return
+    if not fut.done():
+        st.caption("Export en cours…")
+        return
+    if st.session_state.get("export_polling"):
+        st.session_state.export_polling = False
+        st.rerun(scope="app")
+    try:
+        buf, warning = fut.result()
+    except Exception as e:
+        st.error(f"Export impossible : {e}")
+        return
+    if warning:
+        st.warning(warning)
+    st.download_button("Télécharger le fichier Word", buf, file_name="arbre_des_causes.docx", mime=DOCX_MIME)
+
+def aiq_key(q: str, i: int) -> str:
+    # clef stable par contenu pour éviter persistance indésirable
+    return f"aiq_{abs(hash(q)) % (10**9)}_{i}"
+
+def tree_label_index(threshold: float) -> TreeLabelIndex:
+    """Index des libellés de l'arbre (mis à jour par abonnement, recréé si l'arbre ou le seuil change)."""
+    tree = st.session_state.tree
+    index = st.session_state.get("label_index")
+    if index is None or index.tree is not tree or index.threshold != threshold:
+        if index is not None:
+            index.close()
+        index = TreeLabelIndex(tree, threshold)
+        st.session_state.label_index = index
+    return index
+
+def add_node_action():
+    """Rappel du bouton « Ajouter » (valeurs lues dans l'état des widgets)."""
+    label = st.session_state.get("add_label", "").strip()
+    if not label:
+        st.session_state.add_message = ("warning", "Libellé vide.")
+        return
+    tree = st.session_state.tree
+    parent_id = st.session_state.get("add_parent")
+    tree.add_node(label, st.session_state.get("add_cat"), parent_id if parent_id in tree.nodes else "root")
+    st.session_state.add_message = ("success", "Nœud ajouté.")
+
+def update_node_action(node_id):
+    """Rappel du bouton « Mettre à jour » : libellé, catégorie puis rattachement."""
+    tree = st.session_state.tree
+    if node_id not in tree.nodes:
+        return
+    tree.relabel(node_id, st.session_state.get("edit_label", "").strip() or tree.label(node_id),
+                 st.session_state.get("edit_cat"))
+    new_parent = st.session_state.get("edit_parent")
+    if (node_id != "root" and new_parent in tree.nodes and new_parent != tree.parent(node_id)
+            and not tree.is_descendant(node_id, new_parent)):
+        tree.move(node_id, new_parent)
+    st.session_state.edit_message = "Nœud mis à jour."
+
+def inject_selected_questions(selected, parent_id, category, skip):
+    """Rappel du bouton d'injection (exécuté avant les widgets : on peut décocher)."""
+    count = 0
+    for q in selected:
+        if q not in skip:
+            st.session_state.tree.add_node(q, category, parent_id)
+            count += 1
+    msg = f"{count} question(s) ajoutée(s) comme nœud(s)."
+    if len(selected) > count:
+        msg += f" {len(selected) - count} doublon(s) probable(s) ignoré(s)."
+    st.session_state.inj_message = msg
+    # réinitialiser les cases cochées
+    for i, q in enumerate(st.session_state.ai_detected_questions):
+        k = aiq_key(q, i)
+        if k in st.session_state:
+            st.session_state[k] = False
+
+def node_search_index() -> NodeSearchIndex:
+    """Index de recherche de l'arbre courant (mis à jour par abonnement, recréé si l'arbre change)."""
+    tree = st.session_state.tree
+    index = st.session_state.get("node_index")
+    if index is None or index.tree is not tree:
+        index = NodeSearchIndex(tree)
+        st.session_state.node_index = index
+    return index
+
+def set_picker_view(key: str, page: int = 0, scope=False):
+    st.session_state[f"{key}_page"] = page
+    if scope is not False:
+        st.session_state[f"{key}_scope"] = scope
+
+def node_picker(label: str, key: str, default="root", exclude=None, multi: bool = False, skip_root: bool = False):
     """
-    Détecte les puces/questions dans un bloc texte IA.
-    Règles: lignes commençant par -, *, • (avec ou sans espace), et/ou finissant par ?.
-    Ignore les titres (### ...).
+    Sélecteur de nœud paginé : seule la page de résultats (et la sélection
+    courante) est envoyée au navigateur. Au-delà de NODE_PICKER_PAGE nœuds :
+    recherche par début de mots, filtre de catégorie et restriction à un sous-arbre.
+    `exclude` écarte un sous-arbre (parents possibles sans cycle).
     """
-    detected = []
-    for raw in text.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-        if line.startswith("###"):
-            continue
-        bullet = line.startswith(("-", "*", "•"))
-        if bullet:
-            line = line.lstrip("-*• ").strip()
-        if bullet or line.endswith("?"):
-            if len(line) >= 3:
-                detected.append(line)
-    # dédoublonnage simple
-    uniq = []
-    seen = set()
-    for q in detected:
-        k = q.lower()
-        if k not in seen:
-            seen.add(k)
-            uniq.append(q)
-    return uniq
+    tree = st.session_state.tree
+    current = st.session_state.get(key)
+    if multi:
+        current = [n for n in (current or []) if n in tree.nodes]
+    elif current not in tree.nodes or (exclude is not None and tree.is_descendant(exclude, current)):
+        current = default if default in tree.nodes and not (exclude and tree.is_descendant(exclude, default)) else None
+    scope = st.session_state.get(f"{key}_scope")
+    scope = scope if scope in tree.nodes else None
+
+    query, category = "", None
+    searchable = len(tree.nodes) > NODE_PICKER_PAGE
+    if searchable:
+        col_s1, col_s2 = st.columns([2, 1])
+        with col_s1:
+            query = st.text_input(f"Rechercher : {label.lower()}", key=f"{key}_q", placeholder="Début des mots du libellé",
+                                  on_change=set_picker_view, args=(key,))
+        with col_s2:
+            cat = st.selectbox("Catégorie", ["Toutes", *CATEGORIES], key=f"{key}_cat",
+                               on_change=set_picker_view, args=(key,))
+            category = None if cat == "Toutes" else cat
+
+    page = st.session_state.get(f"{key}_page", 0)
+    index = node_search_index()
+    total, ids = index.search(query, subtree=scope, category=category, exclude=exclude,
+                              offset=page * NODE_PICKER_PAGE, limit=NODE_PICKER_PAGE)
+    if page and not ids and total:      # page devenue vide (suppression, filtre)
+        page = 0
+        total, ids = index.search(query, subtree=scope, category=category, exclude=exclude, limit=NODE_PICKER_PAGE)
+    if skip_root:
+        ids = [n for n in ids if n != "root"]
+
+    if multi:
+        st.session_state[key] = current
+        value = st.multiselect(label, options=current + [n for n in ids if n not in current],
+                               format_func=tree.label, key=key)
+    else:
+        options = ids if current is None or current in ids else [current] + ids
+        if current is None:
+            st.session_state.pop(key, None)
+        else:
+            st.session_state[key] = current
+        if not options:
+            st.caption(f"{label} : aucun nœud ne correspond.")
+            return None
+        value = st.selectbox(label, options=options, format_func=tree.label, key=key)
+
+    if searchable or scope is not None:
+        pages = max(1, -(-total // NODE_PICKER_PAGE))
+        col_p1, col_p2, col_p3, col_p4 = st.columns([3, 1, 1, 3])
+        with col_p1:
+            where = f" dans « {tree.label(scope)} »" if scope is not None else ""
+            st.caption(f"{total} résultat(s){where} — page {page + 1}/{pages}")
+        with col_p2:
+            st.button("◀", key=f"{key}_prev", disabled=page == 0, on_click=set_picker_view, args=(key, page - 1))
+        with col_p3:
+            st.button("▶", key=f"{key}_next", disabled=page + 1 >= pages, on_click=set_picker_view, args=(key, page + 1))
+        with col_p4:
+            if scope is not None:
+                st.button("Tout l’arbre", key=f"{key}_unscope", on_click=set_picker_view, args=(key, 0, None))
+            elif not multi and value is not None and tree.children(value):
+                st.button("Limiter à ce sous-arbre", key=f"{key}_scope_btn", on_click=set_picker_view, args=(key, 0, value))
+    return value
+
+# Widgets qui mémorisent un id de nœud : à oublier quand le nœud est supprimé
+NODE_WIDGET_KEYS = ("add_parent", "edit_select", "edit_parent", "inj_parent_ai", "viz_focus", "viz_fold",
+                    "bulk_import_parent", "bulk_target")
+IMPORT_FORMATS = {"Automatique": None, "Plan indenté": "outline", "CSV": "csv", "JSON": "json"}
+
+def forget_deleted_nodes():
+    tree = st.session_state.tree
+    for k in NODE_WIDGET_KEYS:
+        if k in st.session_state and st.session_state[k] not in tree.nodes:
+            del st.session_state[k]
+    for k in [k for k in st.session_state if str(k).endswith("_scope")]:
+        if st.session_state[k] not in tree.nodes:
+            del st.session_state[k]
+    if "bulk_nodes" in st.session_state:
+        st.session_state.bulk_nodes = [n for n in st.session_state.bulk_nodes if n in tree.nodes]
+    st.session_state.viz_expanded &= tree.nodes.keys()
+    st.session_state.viz_collapsed &= tree.nodes.keys()
+
+def import_tree(text, fmt, parent_id):
+    """Rappel du bouton d'import : tout l'arbre importé en une opération groupée."""
+    try:
+        records = parse_tree_import(text, fmt)
+    except ValueError as e:
+        st.session_state.bulk_message = ("error", f"Import impossible : {e}")
+        return
+    if not records:
+        st.session_state.bulk_message = ("warning", "Aucun nœud trouvé dans le texte importé.")
+        return
+    count = st.session_state.tree.import_records(records, parent_id)
+    st.session_state.bulk_message = ("success", f"{count} nœud(s) importé(s).")
+
+def apply_subtree_action(action, node_ids, target):
+    """Rappel du bouton d'action sur les sous-arbres sélectionnés."""
+    tree = st.session_state.tree
+    node_ids = [n for n in node_ids if n != "root"]
+    with tree.bulk():
+        if action == "Déplacer":
+            count = tree.move_many(node_ids, target)
+            msg = f"{count} sous-arbre(s) déplacé(s)."
+            if count < len(node_ids):
+                msg += f" {len(node_ids) - count} ignoré(s) (cycle ou déjà rattaché(s))."
+        elif action == "Dupliquer":
+            for nid in node_ids:
+                tree.duplicate_subtree(nid, target)
+            msg = f"{len(node_ids)} sous-arbre(s) dupliqué(s)."
+        else:
+            count = sum(tree.delete_subtree(nid) for nid in node_ids if nid in tree.nodes)
+            msg = f"{count} nœud(s) supprimé(s)."
+    forget_deleted_nodes()
+    st.session_state.bulk_message = ("success", msg)
+
+def recategorize_nodes(node_ids, category, recursive):
+    count = st.session_state.tree.recategorize(node_ids, category, recursive)
+    st.session_state.bulk_message = ("success", f"Catégorie appliquée à {count} nœud(s).")
 
 # =============== NAVIGATION ===============
+prof.phase("sidebar")
 st.sidebar.title("Navigation")
 page = st.sidebar.radio(
     "Aller vers :",
@@ -240,184 +405,445 @@ page = st.sidebar.radio(
 )
 st.session_state.page = page
 
-# =============== PAGES ===============
-if page == "Arbre des causes":
-    st.title("Arbre des causes")
-
-    # Mise en page compacte : deux colonnes
-    col_left, col_right = st.columns([1, 2], gap="medium")
+# Réouverture automatique (rafraîchissement du navigateur) : ?enquete=<id>
+if st.session_state.inv_id is None and "enquete" in st.query_params:
+    opened = False
+    try:
+        opened = open_investigation(int(st.query_params["enquete"]))
+    except Exception as e:     # id invalide ou enquête illisible : ne pas bloquer chaque rafraîchissement
+        st.sidebar.error(f"Impossible d’ouvrir l’enquête {st.query_params['enquete']} : {e}")
+    if not opened:
+        del st.query_params["enquete"]
+
+st.sidebar.divider()
+st.sidebar.subheader("Enquêtes")
+if st.session_state.inv_id is not None:
+    st.sidebar.caption(f"Enquête ouverte : **{st.session_state.inv_title}** (enregistrement automatique)")
+else:
+    st.sidebar.caption("Analyse non enregistrée.")
+    inv_title = st.sidebar.text_input("Titre de l’enquête", key="inv_new_title")
+    if st.sidebar.button("Enregistrer comme nouvelle enquête", key="inv_save_btn"):
+        if inv_title.strip():
+            save_new_investigation(inv_title.strip())
+            st.rerun()
+        else:
+            st.sidebar.warning("Titre vide.")
+# liste paginée (recherche par titre au-delà d'une page) : toutes les enquêtes restent accessibles
+inv_total = get_investigation_db().count()
+inv_query = ""
+if inv_total > INVESTIGATIONS_PAGE:
+    inv_query = st.sidebar.text_input("Rechercher une enquête", key="inv_query", placeholder="Mot du titre",
+                                      on_change=set_investigation_page)
+inv_matches = get_investigation_db().count(inv_query) if inv_query.strip() else inv_total
+inv_pages = max(1, -(-inv_matches // INVESTIGATIONS_PAGE))
+inv_page = min(st.session_state.get("inv_page", 0), inv_pages - 1)
+recent = get_investigation_db().list_recent(limit=INVESTIGATIONS_PAGE, offset=inv_page * INVESTIGATIONS_PAGE,
+                                            query=inv_query)
+if inv_query.strip() and not recent:
+    st.sidebar.caption("Aucune enquête ne correspond.")
+if inv_matches > INVESTIGATIONS_PAGE:
+    col_p1, col_p2, col_p3 = st.sidebar.columns([3, 1, 1])
+    with col_p1:
+        st.caption(f"{inv_matches} enquête(s) — page {inv_page + 1}/{inv_pages}")
+    with col_p2:
+        st.button("◀", key="inv_prev", disabled=inv_page == 0, on_click=set_investigation_page, args=(inv_page - 1,))
+    with col_p3:
+        st.button("▶", key="inv_next", disabled=inv_page + 1 >= inv_pages,
+                  on_click=set_investigation_page, args=(inv_page + 1,))
+if recent or st.session_state.inv_id is not None:
+    if recent:
+        titles = {inv_id: title for inv_id, title, _ in recent}
+        inv_open = st.sidebar.selectbox("Enquêtes récentes", options=list(titles), format_func=titles.get, key="inv_open")
+    col_i1, col_i2 = st.sidebar.columns([1, 1])
+    with col_i1:
+        if recent and st.button("Ouvrir", key="inv_open_btn"):
+            open_investigation(inv_open)
+            st.rerun()
+    with col_i2:
+        if st.session_state.inv_id is not None and st.button("Nouvelle analyse", key="inv_close_btn"):
+            st.session_state.tree = TreeStore()
+            st.session_state.root_label = "Racine"
+            st.session_state.why, st.session_state.why_problem = [], ""
+            st.session_state.ai_doc_text = st.session_state.ai_questions_text = ""
+            st.session_state.ai_detected_questions = []
+            st.session_state.inv_id = None
+            st.session_state.inv_synced = {}
+            del st.query_params["enquete"]
+            st.rerun()
 
-    with col_left:
-        with st.expander("Nom de la racine", expanded=False):
-            st.caption("Définis le libellé de la case ‘racine’.")
-            st.session_state.root_label = st.text_input("Nom", value=st.session_state.root_label, label_visibility="collapsed")
-            st.session_state.nodes["root"]["label"] = st.session_state.root_label
-
-        with st.expander("Ajouter un nœud", expanded=False):
-            st.caption("Ajoute une cause et rattache-la à un parent.")
-            new_node_label = st.text_input("Libellé", key="add_label", label_visibility="collapsed")
-            parent_id = st.selectbox(
-                "Parent",
-                options=list(st.session_state.nodes.keys()),
-                format_func=lambda x: st.session_state.nodes[x]["label"],
-                key="add_parent"
+if PROFILE_ENABLED or st.query_params.get("admin") == "1":
+    with st.sidebar.expander("Profilage", expanded=False):
+        st.checkbox("Profiler cette session", value=PROFILE_ENABLED, disabled=PROFILE_ENABLED, key="prof_enabled")
+        history = st.session_state.get("prof_history", [])
+        if history:
+            last = history[-1]
+            st.caption(f"Exécution précédente : {last['total'] * 1000:.1f} ms ({len(history)} mesurée(s)).")
+            st.dataframe(
+                [{"Phase": "  " * sp["depth"] + sp["name"], "ms": round(sp["duration"] * 1000, 2)} for sp in last["spans"]],
+                hide_index=True, use_container_width=True,
             )
-            new_node_category = st.selectbox("Catégorie", options=list(CATEGORIES.keys()), index=0, key="add_cat")
-            if st.button("Ajouter", key="add_btn"):
-                if new_node_label.strip():
-                    new_node_id = f"node_{len(st.session_state.nodes)}"
-                    st.session_state.nodes[new_node_id] = {"label": new_node_label.strip(), "category": new_node_category}
-                    st.session_state.edges.append((parent_id, new_node_id))
-                    st.success("Nœud ajouté.")
-                else:
-                    st.warning("Libellé vide.")
-
-        with st.expander("Modifier un nœud existant", expanded=False):
-            node_to_edit = st.selectbox(
-                "Nœud",
-                options=list(st.session_state.nodes.keys()),
-                format_func=lambda x: st.session_state.nodes[x]["label"],
-                key="edit_select"
+            st.json(last["counters"], expanded=False)
+            st.download_button(
+                "Télécharger l’historique (JSON)", json.dumps(history, ensure_ascii=False, indent=2),
+                file_name="profil_arbre_des_causes.json", mime="application/json", key="prof_download",
             )
-            cur_label = st.session_state.nodes[node_to_edit]["label"]
-            cur_cat = st.session_state.nodes[node_to_edit].get("category")
-            cur_parent = get_parent(node_to_edit)
-            edit_label = st.text_input("Nouveau libellé", value=cur_label, key="edit_label")
-            edit_cat_index = list(CATEGORIES.keys()).index(cur_cat) if cur_cat in CATEGORIES else 0
-            edit_cat = st.selectbox("Catégorie", options=list(CATEGORIES.keys()), index=edit_cat_index, key="edit_cat")
-
-            # Parents possibles sans créer de cycle
-            parents_candidates = [nid for nid in st.session_state.nodes.keys() if nid != node_to_edit]
-            parents_candidates = [nid for nid in parents_candidates if not is_descendant(node_to_edit, nid)]
-
-            if node_to_edit == "root":
-                st.info("La racine ne peut pas être rattachée à un parent.")
-                edit_parent = None
+        st.caption("Caches")
+        st.json({
+            "rendu": get_render_cache().stats(),
+            "questions": get_question_cache().stats(),
+            "heuristique": get_heuristic_engine().stats(),
+            "file_ia": get_ai_queue().stats(),
+        }, expanded=False)
+
+# =============== PANNEAUX (fragments : réexécution locale) ===============
+def isolated_panel(phase: str):
+    """
+    Panneau exécuté comme fragment Streamlit : une interaction dans le panneau ne
+    réexécute que lui. Si l'arbre a changé depuis le dernier affichage (version),
+    toute la page est réexécutée pour rafraîchir la visualisation et les sélecteurs.
+    Lors d'une réexécution partielle, le panneau est profilé comme une exécution à
+    part et les champs de l'enquête sont synchronisés.
+    """
+    def decorate(fn):
+        @st.fragment
+        @functools.wraps(fn)
+        def run():
+            partial = not st.session_state.get("full_run", False)
+            if partial and st.session_state.tree.version != st.session_state.get("tree_version_shown"):
+                st.rerun(scope="app")   # arbre modifié par un rappel (on_click) du panneau
+            if partial:
+                start_profile(profiling_wanted(), name=f"fragment:{phase}")
+            current_profile().phase(phase)
+            fn()
+            if not partial:
+                return
+            record_profile(finish_profile())
+            sync_investigation()
+            if st.session_state.tree.version != st.session_state.get("tree_version_shown"):
+                st.rerun(scope="app")
+        return run
+    return decorate
+
+@isolated_panel("ui.root")
+def panel_root():
+    """Nom de la racine."""
+    with st.expander("Nom de la racine", expanded=False):
+        st.caption("Définis le libellé de la case ‘racine’.")
+        st.session_state.root_label = st.text_input("Nom", value=st.session_state.root_label, label_visibility="collapsed")
+        st.session_state.tree.relabel("root", st.session_state.root_label)
+
+@isolated_panel("ui.add")
+def panel_add():
+    """Ajout d'un nœud."""
+    with st.expander("Ajouter un nœud", expanded=False):
+        st.caption("Ajoute une cause et rattache-la à un parent.")
+        st.text_input("Libellé", key="add_label", label_visibility="collapsed")
+        node_picker("Parent", key="add_parent")
+        st.selectbox("Catégorie", options=list(CATEGORIES.keys()), index=0, key="add_cat")
+        st.button("Ajouter", key="add_btn", on_click=add_node_action)
+        if st.session_state.get("add_message"):
+            level, msg = st.session_state.pop("add_message")
+            getattr(st, level)(msg)
+
+@isolated_panel("ui.edit")
+def panel_edit():
+    """Modification d'un nœud (libellé, catégorie, parent)."""
+    prof = current_profile()
+    with st.expander("Modifier un nœud existant", expanded=False):
+        node_to_edit = node_picker("Nœud", key="edit_select")
+        cur_label = st.session_state.tree.nodes[node_to_edit]["label"]
+        cur_cat = st.session_state.tree.nodes[node_to_edit].get("category")
+        cur_parent = get_parent(node_to_edit)
+        st.text_input("Nouveau libellé", value=cur_label, key="edit_label")
+        edit_cat_index = list(CATEGORIES.keys()).index(cur_cat) if cur_cat in CATEGORIES else 0
+        st.selectbox("Catégorie", options=list(CATEGORIES.keys()), index=edit_cat_index, key="edit_cat")
+
+        if node_to_edit == "root":
+            st.info("La racine ne peut pas être rattachée à un parent.")
+        else:
+            # Parents possibles sans créer de cycle (sous-arbre du nœud exclu), parent actuel par défaut
+            if st.session_state.get("edit_parent_for") != node_to_edit:
+                st.session_state.edit_parent_for = node_to_edit
+                st.session_state.pop("edit_parent", None)
+            with prof.span("edit.parent_picker"):
+                node_picker("Nouveau parent", key="edit_parent", default=cur_parent, exclude=node_to_edit)
+
+        st.button("Mettre à jour", key="edit_btn", on_click=update_node_action, args=(node_to_edit,))
+        if st.session_state.get("edit_message"):
+            st.success(st.session_state.pop("edit_message"))
+
+@isolated_panel("ui.bulk")
+def panel_bulk():
+    """Import et opérations groupées."""
+    with st.expander("Opérations groupées", expanded=False):
+        st.caption("Importer une arborescence (plan indenté, CSV id;parent;label;category ou JSON imbriqué).")
+        up_tree = st.file_uploader("Fichier à importer", type=["txt", "md", "csv", "json"], key="bulk_file")
+        import_text = up_tree.getvalue().decode("utf-8-sig", errors="replace") if up_tree is not None else ""
+        import_text = st.text_area(
+            "Texte à importer", value=import_text, height=120, key=f"bulk_text_{up_tree.file_id if up_tree else ''}",
+            placeholder="Chute de plain-pied\n  - Sol glissant [Technique]\n    - Fuite non signalée (Organisationnelle)",
+        )
+        import_fmt = st.selectbox("Format", options=list(IMPORT_FORMATS), key="bulk_fmt")
+        import_parent = node_picker("Rattacher sous", key="bulk_import_parent")
+        st.button(
+            "Importer", key="bulk_import_btn", disabled=not import_text.strip(),
+            on_click=import_tree, args=(import_text, IMPORT_FORMATS[import_fmt], import_parent),
+        )
+
+        st.divider()
+        bulk_nodes = node_picker("Nœuds sélectionnés", key="bulk_nodes", multi=True, skip_root=True)
+        bulk_action = st.selectbox("Action sur les sous-arbres", ["Déplacer", "Dupliquer", "Supprimer"],
+                                   key="bulk_action")
+        bulk_target = node_picker("Vers", key="bulk_target") if bulk_action != "Supprimer" else None
+        st.button(
+            "Appliquer", key="bulk_apply_btn", disabled=not bulk_nodes,
+            on_click=apply_subtree_action, args=(bulk_action, bulk_nodes, bulk_target),
+        )
+        col_b5, col_b6 = st.columns([1, 1])
+        with col_b5:
+            bulk_cat = st.selectbox("Catégorie", options=list(CATEGORIES.keys()), key="bulk_cat")
+        with col_b6:
+            bulk_recursive = st.checkbox("Inclure les sous-arbres", value=False, key="bulk_recursive")
+        st.button(
+            "Recatégoriser", key="bulk_cat_btn", disabled=not bulk_nodes,
+            on_click=recategorize_nodes, args=(bulk_nodes, bulk_cat, bulk_recursive),
+        )
+        if st.session_state.get("bulk_message"):
+            level, msg = st.session_state.pop("bulk_message")
+            getattr(st, level)(msg)
+
+@isolated_panel("ui.ai")
+def panel_ai():
+    """Assistant IA : recueil d'effets -> questions -> nœuds."""
+    prof = current_profile()
+    with st.expander("Assistant IA (Recueil d’effets → Questions)", expanded=False):
+        st.caption("Uploade un .docx **ou** colle ton texte. La sortie est un **bloc à copier-coller** ET une **liste à cocher** pour injecter directement des questions comme nœuds.")
+        up = st.file_uploader("Importer un fichier Word (.docx)", type=["docx"])
+        col_x1, col_x2, col_x3 = st.columns([1, 1, 1])
+        with col_x1:
+            page_from = st.number_input("Page début", min_value=1, value=1, step=1, key="ai_page_from")
+        with col_x2:
+            page_to = st.number_input("Page fin (0 = fin)", min_value=0, value=0, step=1, key="ai_page_to")
+        with col_x3:
+            max_chars = st.number_input("Max caractères (0 = tout)", min_value=0, value=0, step=1000, key="ai_max_chars")
+        if up is not None:
+            try:
+                up.seek(0)
+                st.session_state.ai_doc_text = extract_docx_text(
+                    up,
+                    max_chars=int(max_chars) or None,
+                    pages=(int(page_from), int(page_to) or None),
+                )
+                st.success("Texte extrait du .docx.")
+            except Exception as e:
+                st.error(f"Impossible de lire le .docx : {e}")
+                st.session_state.ai_doc_text = ""
+
+        st.session_state.ai_doc_text = st.text_area(
+            "Ou coller le texte ici",
+            value=st.session_state.ai_doc_text,
+            height=160
+        )
+
+        col_c1, col_c2 = st.columns([1, 2])
+        with col_c1:
+            ai_no_cache = st.checkbox("Ignorer le cache", key="ai_no_cache")
+            ai_chunked = st.checkbox("Découper les longs recueils", key="ai_chunked",
+                                     help="Analyse par morceaux en parallèle puis fusion par thème.")
+            near_threshold = st.slider(
+                "Seuil de quasi-doublons", min_value=0.5, max_value=1.0, value=NEAR_DUP_THRESHOLD, step=0.05,
+                key="ai_near_threshold",
+                help="Similarité à partir de laquelle deux questions sont considérées comme des reformulations (1 = doublons exacts seulement).",
+            )
+            near_threshold = near_threshold if near_threshold < 1.0 else None
+        with col_c2:
+            cstats = get_question_cache().stats()
+            st.caption(
+                f"Cache : {cstats['hits']} succès / {cstats['misses']} échecs, "
+                f"{cstats['bytes_saved'] // 1024} Ko économisés"
+            )
+
+        col_q1, col_q2 = st.columns([1,1])
+        with col_q1:
+            generate = st.button("Générer les questions", key="ai_make_questions")
+        with col_q2:
+            if st.button("Effacer la sortie IA", key="ai_clear"):
+                st.session_state.ai_questions_text = ""
+                st.session_state.ai_detected_questions = []
+
+        if generate:
+            # affichage au fil de l'eau + cases (inactives) dès qu'une question est complète
+            detector = QuestionDetector(near_threshold)
+            queue_ph, stream_ph, live_ph = st.empty(), st.empty(), st.empty()
+            live_box = live_ph.container()
+
+            def _tee(chunks):
+                for chunk in chunks:
+                    for q in detector.feed(chunk):
+                        live_box.checkbox(q, disabled=True, key=f"live_{aiq_key(q, 0)}")
+                    yield chunk
+                for q in detector.finish():
+                    live_box.checkbox(q, disabled=True, key=f"live_{aiq_key(q, 0)}")
+
+            ai_cache = None if ai_no_cache else get_question_cache()
+            if ai_chunked:
+                chunk_warnings = []
+                with st.spinner("Analyse par morceaux en parallèle…"):
+                    source = [ai_questions_chunked(st.session_state.ai_doc_text, cache=ai_cache,
+                                                   on_warning=chunk_warnings.append,
+                                                   near_threshold=near_threshold)]
+                for w in dict.fromkeys(chunk_warnings):
+                    st.warning(w)
             else:
-                default_parent_idx = parents_candidates.index(cur_parent) if cur_parent in parents_candidates else 0
-                edit_parent = st.selectbox(
-                    "Nouveau parent",
-                    options=parents_candidates,
-                    index=default_parent_idx if parents_candidates else 0,
-                    format_func=lambda x: st.session_state.nodes[x]["label"],
-                    key="edit_parent"
-                ) if parents_candidates else None
-
-            if st.button("Mettre à jour", key="edit_btn"):
-                st.session_state.nodes[node_to_edit]["label"] = edit_label.strip() or cur_label
-                st.session_state.nodes[node_to_edit]["category"] = edit_cat
-                if node_to_edit != "root" and edit_parent is not None and edit_parent != cur_parent:
-                    st.session_state.edges = [(s, t) for (s, t) in st.session_state.edges if not (s == cur_parent and t == node_to_edit)]
-                    st.session_state.edges.append((edit_parent, node_to_edit))
-                st.success("Nœud mis à jour.")
-                st.rerun()
-
-        with st.expander("Assistant IA (Recueil d’effets → Questions)", expanded=False):
-            st.caption("Uploade un .docx **ou** colle ton texte. La sortie est un **bloc à copier-coller** ET une **liste à cocher** pour injecter directement des questions comme nœuds.")
-            up = st.file_uploader("Importer un fichier Word (.docx)", type=["docx"])
-            if up is not None:
-                file_bytes = BytesIO(up.read())
-                try:
-                    st.session_state.ai_doc_text = extract_docx_text(file_bytes)
-                    st.success("Texte extrait du .docx.")
-                except Exception as e:
-                    st.error(f"Impossible de lire le .docx : {e}")
-                    st.session_state.ai_doc_text = ""
-
-            st.session_state.ai_doc_text = st.text_area(
-                "Ou coller le texte ici",
-                value=st.session_state.ai_doc_text,
-                height=160
+                def _queue_position(position):
+                    # file d'attente commune à toutes les sessions (limite de débit OpenAI)
+                    if position:
+                        queue_ph.info(f"En file d’attente IA : position {position}…")
+                    else:
+                        queue_ph.empty()
+
+                source = ai_questions_stream(st.session_state.ai_doc_text, cache=ai_cache,
+                                             on_warning=st.warning, on_queue=_queue_position)
+            with prof.span("ai.generate"):
+                full = stream_ph.write_stream(_tee(source))
+            prof.gauge("ai.questions", len(detector.questions))
+            stream_ph.empty()
+            live_ph.empty()
+            st.session_state.ai_questions_text = (full or "").strip()
+            st.session_state.ai_detected_questions = detector.questions
+            st.success("Questions générées.")
+            if detector.near_duplicates:
+                st.caption(f"{len(detector.near_duplicates)} reformulation(s) écartée(s).")
+
+        if st.session_state.ai_questions_text:
+            st.caption("Questions proposées (bloc à copier-coller) :")
+            st.text_area(
+                "Questions",
+                value=st.session_state.ai_questions_text,
+                height=220,
+                label_visibility="collapsed"
             )
 
-            col_q1, col_q2 = st.columns([1,1])
-            with col_q1:
-                if st.button("Générer les questions", key="ai_make_questions"):
-                    st.session_state.ai_questions_text = ai_questions_only(st.session_state.ai_doc_text)
-                    # détecter des questions individuelles pour la liste à cocher
-                    st.session_state.ai_detected_questions = detect_questions_from_text(st.session_state.ai_questions_text)
-                    st.success("Questions générées.")
-            with col_q2:
-                if st.button("Effacer la sortie IA", key="ai_clear"):
-                    st.session_state.ai_questions_text = ""
-                    st.session_state.ai_detected_questions = []
-
-            if st.session_state.ai_questions_text:
-                st.caption("Questions proposées (bloc à copier-coller) :")
-                st.text_area(
-                    "Questions",
-                    value=st.session_state.ai_questions_text,
-                    height=220,
-                    label_visibility="collapsed"
+        if st.session_state.ai_detected_questions:
+            st.divider()
+            st.caption("Cocher des questions pour les ajouter comme nœuds dans l’Arbre :")
+            labels = tree_label_index(near_threshold or 1.0)
+            selected_items, tree_dups = [], set()
+            for i, q in enumerate(st.session_state.ai_detected_questions):
+                match = labels.find(q, first=True)
+                hint = f"Doublon probable du nœud « {match[0][1]} » ({match[0][2]:.0%})." if match else None
+                if st.checkbox(("⚠ " if match else "") + q, key=aiq_key(q, i), help=hint):
+                    selected_items.append(q)
+                    if match:
+                        tree_dups.add(q)
+
+            if selected_items:
+                inj_parent = node_picker("Parent pour les nouvelles questions", key="inj_parent_ai")
+                inj_cat = st.selectbox(
+                    "Catégorie à appliquer",
+                    options=list(CATEGORIES.keys()),
+                    index=0,
+                    key="inj_cat_ai"
                 )
-
-            if st.session_state.ai_detected_questions:
-                st.divider()
-                st.caption("Cocher des questions pour les ajouter comme nœuds dans l’Arbre :")
-                selected_items = []
-                for i, q in enumerate(st.session_state.ai_detected_questions):
-                    # clef stable par contenu pour éviter persistance indésirable
-                    key = f"aiq_{abs(hash(q)) % (10**9)}_{i}"
-                    if st.checkbox(q, key=key):
-                        selected_items.append(q)
-
-                if selected_items:
-                    inj_parent = st.selectbox(
-                        "Parent pour les nouvelles questions",
-                        options=list(st.session_state.nodes.keys()),
-                        format_func=lambda x: st.session_state.nodes[x]["label"],
-                        key="inj_parent_ai"
-                    )
-                    inj_cat = st.selectbox(
-                        "Catégorie à appliquer",
-                        options=list(CATEGORIES.keys()),
-                        index=0,
-                        key="inj_cat_ai"
+                skip_dups = False
+                if tree_dups:
+                    skip_dups = st.checkbox(
+                        f"Ignorer les {len(tree_dups)} doublon(s) probable(s) de l’arbre (⚠)",
+                        value=True, key="inj_skip_dups",
                     )
-                    if st.button("Ajouter les questions sélectionnées dans l’Arbre", key="inj_btn_ai"):
-                        count = 0
-                        for q in selected_items:
-                            new_id = f"node_{len(st.session_state.nodes)}"
-                            st.session_state.nodes[new_id] = {"label": q, "category": inj_cat}
-                            st.session_state.edges.append((inj_parent, new_id))
-                            count += 1
-                        st.success(f"{count} question(s) ajoutée(s) comme nœud(s).")
-                        # réinitialiser les cases cochées
-                        for i, q in enumerate(st.session_state.ai_detected_questions):
-                            k = f"aiq_{abs(hash(q)) % (10**9)}_{i}"
-                            if k in st.session_state:
-                                st.session_state[k] = False
-                        st.rerun()
-
-        with st.expander("Exporter", expanded=False):
-            if st.button("Exporter l’arbre en Word (.docx)", key="export_arbre"):
-                buf = export_arbre_docx(st.session_state.root_label, st.session_state.nodes, st.session_state.edges)
-                st.download_button(
-                    "Télécharger le fichier Word",
-                    buf,
-                    file_name="arbre_des_causes.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                st.button(
+                    "Ajouter les questions sélectionnées dans l’Arbre", key="inj_btn_ai",
+                    on_click=inject_selected_questions,
+                    args=(selected_items, inj_parent, inj_cat, tree_dups if skip_dups else set()),
                 )
 
-    with col_right:
-        st.subheader("Visualisation", anchor=False)
-        dot = graphviz.Digraph("Arbre des Causes", format="png")
-        dot.attr(rankdir=RANKDIR)
-        for node_id, data in st.session_state.nodes.items():
-            label = data.get("label", node_id)
-            cat = data.get("category")
-            if cat in CATEGORIES:
-                dot.node(node_id, label, style="filled", fillcolor=CATEGORIES[cat]["color"])
-            else:
-                dot.node(node_id, label)
-        for src, tgt in st.session_state.edges:
-            if ARROW_MODE == "PARENT_TO_CHILD":
-                dot.edge(src, tgt)
+        if st.session_state.get("inj_message"):
+            st.success(st.session_state.pop("inj_message"))
+
+@isolated_panel("ui.export")
+def panel_export():
+    """Export Word de l'arbre."""
+    prof = current_profile()
+    with st.expander("Exporter", expanded=False):
+        export_image = st.checkbox("Inclure le schéma", value=False, key="export_image")
+        if st.button("Exporter l’arbre en Word (.docx)", key="export_arbre"):
+            tree = st.session_state.tree
+            # instantané : l'export peut tourner pendant que l'arbre est modifié
+            nodes = {nid: dict(d) for nid, d in tree.nodes.items()}
+            args = (st.session_state.root_label, nodes, tree.edges, export_image)
+            if len(nodes) > EXPORT_ASYNC_THRESHOLD:
+                st.session_state.export_future = get_export_executor().submit(build_tree_export, *args)
+                st.session_state.export_polling = True
             else:
-                dot.edge(tgt, src)
-        st.graphviz_chart(dot, use_container_width=True)
+                with prof.span("export.docx"):
+                    buf, warning = build_tree_export(*args)
+                if warning:
+                    st.warning(warning)
+                st.download_button("Télécharger le fichier Word", buf, file_name="arbre_des_causes.docx", mime=DOCX_MIME)
+        fut = st.session_state.get("export_future")
+        st.fragment(export_status, run_every=1.0 if fut is not None and st.session_state.get("export_polling") else None)()
+
+def toggle_fold(fold_id: str, folded: bool):
+    """Rappel du bouton « Déplier / replier » de l'affichage par niveau."""
+    if folded:
+        st.session_state.viz_collapsed.discard(fold_id)
+        st.session_state.viz_expanded.add(fold_id)
+    else:
+        st.session_state.viz_expanded.discard(fold_id)
+        st.session_state.viz_collapsed.add(fold_id)
+
+@isolated_panel("viz")
+def panel_viz():
+    """Visualisation (rafraîchie seulement si l'arbre ou l'affichage change)."""
+    prof = current_profile()
+    st.subheader("Visualisation", anchor=False)
+    tree = st.session_state.tree
+    viz_mode = st.radio(
+        "Affichage",
+        ["Complet", "Par niveau"],
+        index=1 if len(tree.nodes) > LOD_AUTO_THRESHOLD else 0,
+        horizontal=True,
+        key="viz_mode",
+    )
+    if viz_mode == "Par niveau":
+        viz_focus = node_picker("Sous-arbre affiché", key="viz_focus")
+        viz_depth = st.slider("Profondeur", min_value=1, max_value=10, value=2, key="viz_depth")
+        with prof.span("viz.lod"):
+            view_nodes, view_edges, foldable = build_lod_view(
+                tree, viz_focus, viz_depth,
+                st.session_state.viz_expanded, st.session_state.viz_collapsed,
+            )
+        if foldable:
+            col_v3, col_v4 = st.columns([3, 1])
+            with col_v3:
+                fold_id = st.selectbox(
+                    "Branche",
+                    options=foldable,
+                    format_func=lambda x: ("▸ " if f"{SUMMARY_PREFIX}{x}" in view_nodes else "▾ ") + tree.label(x),
+                    key="viz_fold",
+                )
+            with col_v4:
+                st.write("")
+                st.button("Déplier / replier", key="viz_fold_btn", on_click=toggle_fold,
+                          args=(fold_id, f"{SUMMARY_PREFIX}{fold_id}" in view_nodes))
+        shown = sum(1 for d in view_nodes.values() if not d.get("summary"))
+        st.caption(f"{shown} nœud(s) affiché(s) sur {len(tree.nodes)}.")
+    else:
+        view_nodes, view_edges = tree.nodes, tree.edges
+    prof.gauge("view.nodes", len(view_nodes))
+    prof.gauge("view.edges", len(view_edges))
+    with prof.span("viz.digraph"):
+        _, dot_source = get_render_cache().get_dot(view_nodes, view_edges)
+    with prof.span("viz.chart"):   # la mise en page Graphviz se fait ensuite dans le navigateur
+        st.graphviz_chart(dot_source, use_container_width=True)
+
+def reset_why():
+    """Rappel du bouton « Réinitialiser » (5 Pourquoi)."""
+    st.session_state.why = []
 
-elif page == "5 Pourquoi":
+@isolated_panel("page.why")
+def page_why():
+    """Page 5 Pourquoi."""
     st.title("5 Pourquoi")
     st.markdown("**Conseils : viser 5 pourquoi.**")
 
@@ -433,9 +859,7 @@ elif page == "5 Pourquoi":
             if st.session_state.why:
                 st.session_state.why.pop()
     with col_c:
-        if st.button("Réinitialiser"):
-            st.session_state.why = []
-            st.rerun()
+        st.button("Réinitialiser", on_click=reset_why)
 
     for i in range(len(st.session_state.why)):
         st.session_state.why[i] = st.text_input(f"Réponse au Pourquoi n°{i+1}", value=st.session_state.why[i], key=f"why_{i}")
@@ -449,19 +873,41 @@ elif page == "5 Pourquoi":
 
     with st.expander("Exporter", expanded=False):
         if st.button("Exporter en Word (.docx)", key="export_why"):
-            doc = Document()
-            doc.add_heading("Analyse 5 Pourquoi", 0)
-            if st.session_state.why_problem:
-                doc.add_paragraph(f"Problème observé : {st.session_state.why_problem}")
-            for i, ans in enumerate(st.session_state.why, 1):
-                if ans.strip():
-                    doc.add_paragraph(f"{i}. Pourquoi ? — {ans.strip()}")
-            buf = BytesIO()
-            doc.save(buf)
-            buf.seek(0)
+            buf = export_why_docx(st.session_state.why_problem, st.session_state.why)
             st.download_button(
                 "Télécharger le fichier Word",
                 buf,
                 file_name="analyse_5_pourquoi.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                mime=DOCX_MIME,
             )
+
+# =============== PAGES ===============
+if page == "Arbre des causes":
+    st.title("Arbre des causes")
+
+    # Mise en page compacte : deux colonnes
+    col_left, col_right = st.columns([1, 2], gap="medium")
+
+    with col_left:
+        panel_root()
+        panel_add()
+        panel_edit()
+        panel_bulk()
+        panel_ai()
+        panel_export()
+
+    with col_right:
+        panel_viz()
+
+elif page == "5 Pourquoi":
+    page_why()
+
+# =============== ENREGISTREMENT ===============
+prof.phase("sync")
+sync_investigation()
+prof.gauge("tree.nodes", len(st.session_state.tree.nodes))
+prof.gauge("tree.edges", len(st.session_state.tree.nodes) - 1)
+
+record_profile(finish_profile())
+st.session_state.tree_version_shown = st.session_state.tree.version
+st.session_state.full_run = False
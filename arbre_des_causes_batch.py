@@ -0,0 +1,174 @@
+# fichier: arbre_des_causes_batch.py
+"""
+Traitement par lots (sans Streamlit) d'un répertoire de recueils d'effets .docx.
+
+Pour chaque rapport, écrit dans le répertoire de sortie :
+- <nom>.questions.md   : bloc de questions (comme l'assistant IA)
+- <nom>.questions.json : liste des questions détectées
+- <nom>.arbre.docx     : arbre initial (option --seed-tree)
+
+Les rapports déjà traités (JSON plus récent que le .docx) sont ignorés, ce qui
+permet de reprendre après une interruption ; --force retraite tout.
+Chaque fin de traitement est journalisée dans batch_manifest.jsonl.
+
+Exemple :
+    python arbre_des_causes_batch.py recueils/ -o sorties/ --workers 4 --seed-tree
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from arbre_des_causes_core import (
+    AI_CACHE_PATH,
+    QuestionCache,
+    ai_questions_chunked,
+    ai_questions_only,
+    detect_questions_from_text,
+    export_arbre_docx,
+    extract_docx_text,
+    seed_tree_from_questions,
+)
+
+MANIFEST_NAME = "batch_manifest.jsonl"
+
+
+def find_reports(input_dir: str, recursive: bool = False):
+    """Fichiers .docx du répertoire (hors fichiers de verrou Word ~$)."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        for name in filenames:
+            if name.lower().endswith(".docx") and not name.startswith("~$"):
+                found.append(os.path.join(dirpath, name))
+        if not recursive:
+            break
+    return sorted(found)
+
+
+def output_paths(report: str, input_dir: str, output_dir: str) -> dict:
+    rel = os.path.splitext(os.path.relpath(report, input_dir))[0]
+    base = os.path.join(output_dir, rel)
+    return {
+        "md": base + ".questions.md",
+        "json": base + ".questions.json",
+        "docx": base + ".arbre.docx",
+    }
+
+
+def is_done(report: str, paths: dict, seed_tree: bool) -> bool:
+    """Reprise : le JSON (écrit en dernier) existe et est plus récent que le rapport."""
+    if not os.path.exists(paths["json"]):
+        return False
+    if seed_tree and not os.path.exists(paths["docx"]):
+        return False
+    return os.path.getmtime(paths["json"]) >= os.path.getmtime(report)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def process_report(report: str, input_dir: str, output_dir: str, options: dict) -> dict:
+    """Traite un rapport (exécuté dans un processus de travail) ; renvoie les durées."""
+    paths = output_paths(report, input_dir, output_dir)
+    os.makedirs(os.path.dirname(paths["json"]), exist_ok=True)
+    cache = None if options.get("no_cache") else QuestionCache(options.get("cache_path") or AI_CACHE_PATH)
+    warnings = []
+    timings = {}
+
+    t0 = time.perf_counter()
+    with open(report, "rb") as f:
+        text = extract_docx_text(f, max_chars=options.get("max_chars"))
+    timings["extract"] = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    if options.get("chunked"):
+        block = ai_questions_chunked(text, cache=cache, on_warning=warnings.append)
+    else:
+        block = ai_questions_only(text, cache=cache, on_warning=warnings.append)
+    questions = detect_questions_from_text(block)
+    timings["questions"] = time.perf_counter() - t1
+
+    _write_atomic(paths["md"], block.encode("utf-8"))
+    if options.get("seed_tree"):
+        t2 = time.perf_counter()
+        tree = seed_tree_from_questions(block, os.path.splitext(os.path.basename(report))[0])
+        buf = export_arbre_docx(tree.label("root"), tree.nodes, tree.edges)
+        _write_atomic(paths["docx"], buf.getvalue())
+        timings["export"] = time.perf_counter() - t2
+    payload = {"source": report, "questions": questions}
+    _write_atomic(paths["json"], json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    timings["total"] = time.perf_counter() - t0
+    return {
+        "source": report,
+        "chars": len(text),
+        "questions": len(questions),
+        "warnings": warnings,
+        "timings": {k: round(v, 3) for k, v in timings.items()},
+    }
+
+
+def run_batch(input_dir: str, output_dir: str, workers: int = None, recursive: bool = False,
+              force: bool = False, **options) -> list:
+    reports = find_reports(input_dir, recursive)
+    todo = []
+    for r in reports:
+        if force or not is_done(r, output_paths(r, input_dir, output_dir), options.get("seed_tree")):
+            todo.append(r)
+    print(f"{len(reports)} rapport(s), {len(reports) - len(todo)} déjà traité(s), {len(todo)} à traiter.")
+    if not todo:
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = os.path.join(output_dir, MANIFEST_NAME)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(manifest, "a", encoding="utf-8") as log:
+        futures = {pool.submit(process_report, r, input_dir, output_dir, options): r for r in todo}
+        for fut in as_completed(futures):
+            report = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"source": report, "error": f"{type(e).__name__}: {e}"}
+                print(f"ÉCHEC  {report} : {res['error']}", file=sys.stderr)
+            else:
+                t = res["timings"]
+                print(f"OK     {report} : {res['questions']} question(s), "
+                      + ", ".join(f"{k} {v:.2f}s" for k, v in t.items()))
+            log.write(json.dumps(res, ensure_ascii=False) + "\n")
+            log.flush()
+            results.append(res)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Génère les questions d'enquête pour un répertoire de recueils .docx.")
+    parser.add_argument("input_dir", help="Répertoire contenant les .docx")
+    parser.add_argument("-o", "--output-dir", required=True, help="Répertoire de sortie")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Nombre de processus (défaut : nb de cœurs)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Parcourir les sous-répertoires")
+    parser.add_argument("--seed-tree", action="store_true", help="Écrire aussi un arbre initial .docx")
+    parser.add_argument("--chunked", action="store_true", help="Mode découpé (map-reduce) pour les longs recueils")
+    parser.add_argument("--max-chars", type=int, default=None, help="Limiter le texte extrait par rapport")
+    parser.add_argument("--no-cache", action="store_true", help="Ne pas utiliser le cache des questions")
+    parser.add_argument("--cache-path", default=None, help="Fichier SQLite du cache des questions")
+    parser.add_argument("--force", action="store_true", help="Retraiter les rapports déjà traités")
+    args = parser.parse_args(argv)
+
+    results = run_batch(
+        args.input_dir, args.output_dir,
+        workers=args.workers, recursive=args.recursive, force=args.force,
+        seed_tree=args.seed_tree, chunked=args.chunked, max_chars=args.max_chars,
+        no_cache=args.no_cache, cache_path=args.cache_path,
+    )
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+# fichier: arbre_des_causes_bench.py
+"""
+Banc de mesures (hors ligne, sans Streamlit) sur des arbres synthétiques.
+
+Génère des arbres de 100 à 100 000 nœuds de plusieurs formes :
+- chain    : chaîne profonde (chaque nœud est l'enfant du précédent)
+- fan      : éventail (tous les nœuds sous la racine)
+- balanced : arbre équilibré (4 enfants par nœud)
+- random   : parent tiré au hasard parmi les nœuds existants (graine fixe)
+
+et chronomètre les opérations dont dépend l'interface : parent, is_descendant,
+build_children_map, filtrage des parents candidats, recherche du sélecteur de
+nœuds, construction du Digraph, export Word, extraction .docx et détection des
+questions (exacte, puis avec quasi-doublons). Le LLM est remplacé par
+l'heuristique locale (OPENAI_API_KEY ignorée) : aucun appel réseau.
+
+Les résultats sont écrits en JSON ; --compare compare à une référence et
+renvoie le code 1 si une mesure régresse au-delà du seuil.
+
+Exemples :
+    python arbre_des_causes_bench.py -o bench.json
+    python arbre_des_causes_bench.py --sizes 100,1000 --compare bench.json --threshold 0.3
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+from io import BytesIO
+
+from docx import Document
+
+from arbre_des_causes_core import (
+    AI_THEMES,
+    CATEGORIES,
+    NEAR_DUP_THRESHOLD,
+    NodeSearchIndex,
+    TreeStore,
+    ai_questions_chunked,
+    ai_questions_only,
+    build_children_map,
+    build_digraph,
+    detect_questions_from_text,
+    export_arbre_docx,
+    extract_docx_text,
+)
+
+SHAPES = ("chain", "fan", "balanced", "random")
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+# opérations coûteuses : taille maximale mesurée par défaut (--full pour tout mesurer)
+HEAVY_MAX_SIZE = {"digraph": 20000, "export_docx": 10000, "extract_docx": 20000, "near_dedupe": 10000}
+SAMPLE_QUERIES = 1000
+SEED = 1234
+
+_VOCAB = (
+    "balisage", "signalisation", "fatigue", "procédure", "consignation", "météo", "visibilité",
+    "maintenance", "formation", "supervision", "planning", "équipement", "interlock", "radio",
+    "permis", "contrôle", "barrière", "astreinte", "trafic", "harnais", "nacelle", "solvant",
+)
+
+
+# =============== GÉNÉRATION ===============
+def synthetic_tree(shape: str, size: int, seed: int = SEED) -> TreeStore:
+    """Arbre de `size` nœuds (racine comprise) de la forme demandée."""
+    rng = random.Random(seed)
+    cats = list(CATEGORIES)
+    tree = TreeStore(f"Arbre {shape} {size}")
+    ids = ["root"]
+    for i in range(1, size):
+        if shape == "chain":
+            parent = ids[-1]
+        elif shape == "fan":
+            parent = "root"
+        elif shape == "balanced":
+            parent = ids[(i - 1) // 4]
+        else:
+            parent = ids[rng.randrange(len(ids))]
+        ids.append(tree.add_node(f"Cause {i} : {rng.choice(_VOCAB)} {rng.choice(_VOCAB)}", cats[i % len(cats)], parent))
+    return tree
+
+def synthetic_sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(_VOCAB) for _ in range(words)).capitalize() + "."
+
+def synthetic_docx(paragraphs: int, seed: int = SEED) -> bytes:
+    """Recueil d'effets .docx de `paragraphs` paragraphes (avec un tableau)."""
+    rng = random.Random(seed)
+    doc = Document()
+    doc.add_heading("Recueil d’effets (synthétique)", level=1)
+    for _ in range(paragraphs):
+        doc.add_paragraph(synthetic_sentence(rng))
+    table = doc.add_table(rows=10, cols=3)
+    for row in table.rows:
+        for cell in row.cells:
+            cell.text = synthetic_sentence(rng, 4)
+    buf = BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+def synthetic_question_block(count: int, seed: int = SEED) -> str:
+    """Bloc markdown de `count` questions réparties par thèmes (un quart de reformulations)."""
+    rng = random.Random(seed)
+    lines = []
+    per_theme = max(1, count // len(AI_THEMES))
+    asked = []
+    for theme in AI_THEMES:
+        lines.append(f"### {theme}")
+        for _ in range(per_theme):
+            if asked and rng.random() < 0.25:
+                q = rng.choice(asked).replace(" ?", " exactement ?")
+            else:
+                q = f"{synthetic_sentence(rng, 10)[:-1]} (preuves: {rng.choice(_VOCAB)}) ?"
+                asked.append(q)
+            lines.append(f"- {q}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+# =============== MESURES ===============
+def measure(fn, repeat: int) -> dict:
+    """Meilleur temps et médiane sur `repeat` exécutions (secondes)."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"best": min(times), "median": statistics.median(times), "repeat": repeat}
+
+def tree_benchmarks(tree: TreeStore, rng: random.Random):
+    """(nom, fonction) des opérations mesurées sur un arbre déjà construit."""
+    ids = list(tree.nodes)
+    sample = [rng.choice(ids) for _ in range(SAMPLE_QUERIES)]
+    pairs = [(rng.choice(ids), rng.choice(ids)) for _ in range(SAMPLE_QUERIES)]
+    edges = tree.edges
+    nodes = tree.nodes
+
+    def parents():
+        for nid in sample:
+            tree.parent(nid)
+
+    def descendants():
+        for a, b in pairs:
+            tree.is_descendant(a, b)
+
+    def renumber():
+        tree._dirty = True      # renumérotation paresseuse déclenchée par une modification
+        tree._renumber()
+
+    def candidates():
+        tree.move_candidates(sample[0])
+
+    index = NodeSearchIndex(tree)
+
+    def search():
+        for query in ("fat", "bal sig", "cause 1"):
+            index.search(query, limit=50)
+        index.search("", category="HUMAINE", exclude=sample[0], limit=50)
+
+    return [
+        ("get_parent", parents),
+        ("renumber", renumber),
+        ("is_descendant", descendants),
+        ("build_children_map", lambda: build_children_map(edges)),
+        ("move_candidates", candidates),
+        ("node_search", search),
+        ("digraph", lambda: build_digraph(nodes, edges).source),
+        ("export_docx", lambda: export_arbre_docx(tree.label("root"), nodes, edges)),
+    ]
+
+def run_benchmarks(sizes, shapes, repeat: int = 3, full: bool = False, only=None, log=print) -> dict:
+    os.environ.pop("OPENAI_API_KEY", None)     # LLM remplacé par l'heuristique locale
+    rng = random.Random(SEED)
+    results = {}
+
+    def record(name, size, shape, fn, rep=repeat):
+        if only and name not in only:
+            return
+        if not full and size > HEAVY_MAX_SIZE.get(name, size):
+            return
+        key = f"{name}/{shape}/{size}" if shape else f"{name}/{size}"
+        results[key] = measure(fn, rep)
+        log(f"{key:<40} {results[key]['best'] * 1000:10.2f} ms")
+
+    for size in sizes:
+        for shape in shapes:
+            t0 = time.perf_counter()
+            tree = synthetic_tree(shape, size)
+            if not only or "build_tree" in only:
+                results[f"build_tree/{shape}/{size}"] = {"best": time.perf_counter() - t0, "median": None, "repeat": 1}
+            for name, fn in tree_benchmarks(tree, rng):
+                record(name, size, shape, fn, 1 if name == "export_docx" else repeat)
+
+        # documents et blocs de texte : taille = nombre de paragraphes / de questions
+        doc_bytes = synthetic_docx(size) if full or size <= HEAVY_MAX_SIZE["extract_docx"] else None
+        if doc_bytes is not None:
+            record("extract_docx", size, None, lambda: extract_docx_text(BytesIO(doc_bytes)))
+        block = synthetic_question_block(size)
+        record("detect_questions", size, None, lambda: detect_questions_from_text(block))
+        record("near_dedupe", size, None, lambda: detect_questions_from_text(block, near_threshold=NEAR_DUP_THRESHOLD))
+        text = "\n".join(synthetic_sentence(rng) for _ in range(size))
+        record("ai_questions_stub", size, None, lambda: ai_questions_only(text))
+        record("ai_questions_chunked_stub", size, None, lambda: ai_questions_chunked(text, cache=None))
+    return results
+
+
+# =============== COMPARAISON ===============
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float):
+    """
+    Régressions [(clé, référence, actuel, ratio)] : meilleur temps plus lent que la
+    référence de plus de `threshold` (relatif) ET de `min_delta` secondes (bruit).
+    """
+    regressions = []
+    for key, cur in results.items():
+        ref = baseline.get(key)
+        if ref is None:
+            continue
+        before, after = ref["best"], cur["best"]
+        if after - before > min_delta and after > before * (1 + threshold):
+            regressions.append((key, before, after, after / before if before else float("inf")))
+    return sorted(regressions, key=lambda r: -r[3])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mesure les performances de l'arbre des causes sur des données synthétiques.")
+    parser.add_argument("-o", "--output", default=None, help="Fichier JSON de résultats")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Tailles séparées par des virgules")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help=f"Formes parmi {', '.join(SHAPES)}")
+    parser.add_argument("--only", default=None, help="Limiter à certaines mesures (ex. digraph,export_docx)")
+    parser.add_argument("--repeat", type=int, default=3, help="Répétitions par mesure (meilleur temps retenu)")
+    parser.add_argument("--full", action="store_true", help="Mesurer aussi les opérations coûteuses aux grandes tailles")
+    parser.add_argument("--compare", default=None, help="JSON de référence à comparer")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Régression tolérée (0.25 = +25 %%)")
+    parser.add_argument("--min-delta", type=float, default=0.002, help="Écart absolu minimal en secondes")
+    args = parser.parse_args(argv)
+
+    shapes = [s for s in args.shapes.split(",") if s]
+    unknown = set(shapes) - set(SHAPES)
+    if unknown:
+        parser.error(f"formes inconnues : {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    only = set(args.only.split(",")) if args.only else None
+
+    results = run_benchmarks(sizes, shapes, repeat=args.repeat, full=args.full, only=only)
+    payload = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "shapes": shapes,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"Résultats écrits dans {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        for key, before, after, ratio in regressions:
+            print(f"RÉGRESSION {key} : {before * 1000:.2f} ms -> {after * 1000:.2f} ms (x{ratio:.2f})", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"Aucune régression au-delà de {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
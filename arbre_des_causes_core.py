@@ -0,0 +1,2179 @@
+# fichier: arbre_des_causes_core.py
+"""
+Fonctions « pures » de l'Arbre des causes (sans Streamlit) : arbre indexé,
+rendu Graphviz, extraction .docx, génération / détection des questions,
+export Word. Utilisées par l'application (arbre_des_causes_app.py) et par
+le traitement par lots (arbre_des_causes_batch.py).
+"""
+import os
+import io
+import csv
+import json
+import re
+import bisect
+import hashlib
+import logging
+import time
+import random
+import sqlite3
+import threading
+import unicodedata
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape as xml_escape
+from io import BytesIO
+from itertools import islice
+from collections import Counter, defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import graphviz
+from docx import Document  # python-docx
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.shared import Inches
+
+logger = logging.getLogger(__name__)
+
+# =============== CONSTANTES ===============
+CATEGORIES = {
+    "ORGANISATIONNELLE": {"color": "#5B9BD5", "desc": "Bleu soutenu"},
+    "HUMAINE": {"color": "#ED7D31", "desc": "Orange soutenu"},
+    "TECHNIQUE": {"color": "#A6A6A6", "desc": "Gris soutenu"},
+}
+RANKDIR = "RL"               # racine à droite -> causes à gauche
+ARROW_MODE = "PARENT_TO_CHILD"  # flèches Parent -> Enfant
+UNCATEGORIZED = "NON DÉFINI"
+
+# =============== INSTRUMENTATION (profilage par exécution) ===============
+PROFILE_ENABLED = os.environ.get("ARBRE_PROFILE", "").lower() in ("1", "true", "yes", "on")
+profile_logger = logging.getLogger("arbre.profile")
+
+class RunProfile:
+    """
+    Mesures d'une exécution (un rerun Streamlit, un rapport du traitement par lots) :
+    - phases successives (`phase`) : chaque appel clôt la phase précédente ;
+    - intervalles imbriqués (`span`, gestionnaire de contexte) ;
+    - compteurs cumulés (`count`) ou valeurs instantanées (`gauge`).
+    """
+    enabled = True
+
+    def __init__(self, name: str = "rerun"):
+        self.name = name
+        self.started = time.time()
+        self.total = None
+        self.spans = []         # (nom, profondeur, début relatif, durée) en secondes
+        self.counters = {}
+        self._t0 = time.perf_counter()
+        self._depth = 0
+        self._phase = None      # (index dans spans, début)
+
+    @contextmanager
+    def span(self, name: str):
+        idx = len(self.spans)
+        self.spans.append(None)     # place réservée : ordre de début conservé
+        depth = self._depth
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth = depth
+            self.spans[idx] = (name, depth, start - self._t0, time.perf_counter() - start)
+
+    def phase(self, name: str):
+        self._close_phase()
+        self._phase = (len(self.spans), name, time.perf_counter())
+        self.spans.append(None)
+        self._depth = 1
+
+    def _close_phase(self):
+        if self._phase is not None:
+            idx, name, start = self._phase
+            self.spans[idx] = (name, 0, start - self._t0, time.perf_counter() - start)
+            self._phase = None
+            self._depth = 0
+
+    def count(self, name: str, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name: str, value):
+        self.counters[name] = value
+
+    def finish(self):
+        self._close_phase()
+        self.total = time.perf_counter() - self._t0
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started": self.started,
+            "total": self.total,
+            "spans": [
+                {"name": n, "depth": d, "start": round(st, 6), "duration": round(du, 6)}
+                for n, d, st, du in (s for s in self.spans if s is not None)
+            ],
+            "counters": dict(self.counters),
+        }
+
+    def log_line(self) -> str:
+        """Une ligne « clé=valeur » (phases de premier niveau en ms, puis compteurs)."""
+        parts = [f"{self.name} total={(self.total or 0) * 1000:.1f}ms"]
+        parts += [f"{n}={du * 1000:.1f}ms" for n, d, _, du in (s for s in self.spans if s is not None) if d == 0]
+        parts += [f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in self.counters.items()]
+        return " ".join(parts)
+
+class _NullProfile:
+    """Profil désactivé : chaque appel ne coûte qu'une recherche d'attribut."""
+    enabled = False
+    _span = nullcontext()
+
+    def span(self, name):
+        return self._span
+
+    def phase(self, name):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+NULL_PROFILE = _NullProfile()
+_profile_local = threading.local()   # un profil par fil (une session Streamlit = un fil de script)
+
+def current_profile():
+    return getattr(_profile_local, "profile", NULL_PROFILE)
+
+def start_profile(enabled: bool, name: str = "rerun"):
+    prof = RunProfile(name) if enabled else NULL_PROFILE
+    _profile_local.profile = prof
+    return prof
+
+def finish_profile():
+    """Clôt le profil du fil courant, l'écrit dans le journal « arbre.profile » et le renvoie."""
+    prof = current_profile()
+    _profile_local.profile = NULL_PROFILE
+    if not prof.enabled:
+        return None
+    prof.finish()
+    profile_logger.info(prof.log_line())
+    return prof
+
+# =============== ARBRE INDEXÉ ===============
+class TreeStore:
+    """
+    Arbre des causes indexé.
+    - `nodes` : id -> {"label", "category"} (ordre d'insertion conservé)
+    - index parent (enfant -> parent) et enfants (parent -> [enfants]) tenus à jour
+      à chaque ajout / déplacement / renommage
+    - numérotation par intervalles (entrée/sortie de parcours) pour répondre
+      en O(1) à « X est-il dans le sous-arbre de Y ? ». Elle est recalculée
+      paresseusement (une passe O(N)) après un ajout ou un déplacement.
+    - effectifs par catégorie de chaque sous-arbre, calculés dans la même passe.
+    - abonnés (`subscribe`) prévenus de chaque modification : fn(arbre, événement, id)
+      avec événement "add" / "move" / "relabel" / "delete" (persistance incrémentale).
+      Dans un bloc `with arbre.bulk():`, les événements sont regroupés et remis
+      en une fois : fn(arbre, "bulk", [(événement, id), ...]).
+    - identifiants "node_<n>" attribués par un compteur croissant, jamais réutilisés
+      (pas de collision après suppression).
+    """
+
+    def __init__(self, root_label: str = "Racine"):
+        self.nodes = {"root": {"label": root_label, "category": None}}
+        self._parent = {}                  # enfant -> parent (ordre = ordre des liens)
+        self._children = defaultdict(list)  # parent -> [enfants]
+        self._tin = {}
+        self._tout = {}
+        self._counts = {}
+        self._dirty = True
+        self._listeners = []
+        self._bulk_depth = 0
+        self._pending = []
+        self._next_id = 1
+        self.version = 0    # incrémenté à chaque modification (clé de cache)
+
+    def subscribe(self, fn):
+        self._listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def _emit(self, event: str, node_id: str):
+        self.version += 1
+        if self._bulk_depth:
+            self._pending.append((event, node_id))
+            return
+        for fn in self._listeners:
+            fn(self, event, node_id)
+
+    @contextmanager
+    def bulk(self):
+        """Regroupe les notifications d'une opération groupée (une écriture en base)."""
+        self._bulk_depth += 1
+        try:
+            yield self
+        finally:
+            self._bulk_depth -= 1
+            if not self._bulk_depth and self._pending:
+                events, self._pending = self._pending, []
+                for fn in self._listeners:
+                    fn(self, "bulk", events)
+
+    def new_id(self) -> str:
+        while f"node_{self._next_id}" in self.nodes:
+            self._next_id += 1
+        node_id = f"node_{self._next_id}"
+        self._next_id += 1
+        return node_id
+
+    # ---- lecture ----
+    @property
+    def edges(self):
+        """Liens (parent, enfant) dans l'ordre de création/déplacement."""
+        return [(src, tgt) for tgt, src in self._parent.items()]
+
+    def parent(self, node_id: str):
+        return self._parent.get(node_id)
+
+    def children(self, node_id: str):
+        return list(self._children.get(node_id, ()))
+
+    def label(self, node_id: str) -> str:
+        return self.nodes[node_id]["label"]
+
+    def is_descendant(self, root_id: str, query_id: str) -> bool:
+        """True si query_id est dans le sous-arbre de root_id (root_id inclus)."""
+        if root_id == query_id:
+            return True
+        if self._dirty:
+            self._renumber()
+        a, b = self._tin.get(root_id), self._tin.get(query_id)
+        if a is None or b is None:
+            return False
+        return a <= b and self._tout[query_id] <= self._tout[root_id]
+
+    def subtree_counts(self, node_id: str) -> dict:
+        """Nombre de descendants (node_id exclu) par catégorie."""
+        if self._dirty:
+            self._renumber()
+        return dict(self._counts.get(node_id, {}))
+
+    def move_candidates(self, node_id: str):
+        """Parents possibles pour node_id sans créer de cycle (hors sous-arbre)."""
+        return [nid for nid in self.nodes if not self.is_descendant(node_id, nid)]
+
+    def subtree(self, node_id: str):
+        """Ids du sous-arbre (node_id inclus) en préordre, en O(taille du sous-arbre)."""
+        out = []
+        stack = [node_id]
+        while stack:
+            nid = stack.pop()
+            out.append(nid)
+            stack.extend(reversed(self._children.get(nid, ())))
+        return out
+
+    # ---- écriture ----
+    def add_node(self, label: str, category, parent_id: str, node_id: str = None) -> str:
+        if parent_id not in self.nodes:
+            raise KeyError(parent_id)
+        if node_id is None:
+            node_id = self.new_id()
+        elif node_id in self.nodes:
+            raise ValueError(f"Identifiant déjà utilisé : {node_id}")
+        else:
+            suffix = node_id[5:] if node_id.startswith("node_") else ""
+            if suffix.isdigit():
+                self._next_id = max(self._next_id, int(suffix) + 1)
+        self.nodes[node_id] = {"label": label, "category": category}
+        self._parent[node_id] = parent_id
+        self._children[parent_id].append(node_id)
+        self._dirty = True
+        self._emit("add", node_id)
+        return node_id
+
+    def relabel(self, node_id: str, label: str = None, category=None):
+        changed = False
+        if label is not None and label != self.nodes[node_id]["label"]:
+            self.nodes[node_id]["label"] = label
+            changed = True
+        if category is not None and category != self.nodes[node_id].get("category"):
+            self.nodes[node_id]["category"] = category
+            self._dirty = True
+            changed = True
+        if changed:
+            self._emit("relabel", node_id)
+
+    def move(self, node_id: str, new_parent: str):
+        if node_id == "root":
+            raise ValueError("La racine ne peut pas être déplacée.")
+        if self.is_descendant(node_id, new_parent):
+            raise ValueError("Déplacement impossible : créerait un cycle.")
+        old_parent = self._parent.pop(node_id, None)
+        if old_parent is not None:
+            self._children[old_parent].remove(node_id)
+        self._parent[node_id] = new_parent
+        self._children[new_parent].append(node_id)
+        self._dirty = True
+        self._emit("move", node_id)
+
+    # ---- opérations groupées (coût proportionnel au sous-arbre) ----
+    def delete_subtree(self, node_id: str) -> int:
+        """Supprime node_id et tous ses descendants ; renvoie le nombre de nœuds supprimés."""
+        if node_id == "root":
+            raise ValueError("La racine ne peut pas être supprimée.")
+        ids = self.subtree(node_id)
+        with self.bulk():
+            parent = self._parent.pop(node_id, None)
+            if parent is not None:
+                self._children[parent].remove(node_id)
+            for nid in reversed(ids):   # feuilles d'abord
+                self._children.pop(nid, None)
+                self._parent.pop(nid, None)
+                del self.nodes[nid]
+                self._emit("delete", nid)
+        self._dirty = True
+        return len(ids)
+
+    def duplicate_subtree(self, node_id: str, new_parent: str) -> str:
+        """Copie node_id et ses descendants sous new_parent ; renvoie l'id de la copie."""
+        if new_parent not in self.nodes:
+            raise KeyError(new_parent)
+        mapping = {}
+        with self.bulk():
+            for nid in self.subtree(node_id):
+                data = self.nodes[nid]
+                parent = mapping.get(self._parent.get(nid), new_parent)
+                mapping[nid] = self.add_node(data["label"], data.get("category"), parent)
+        return mapping[node_id]
+
+    def move_many(self, node_ids, new_parent: str) -> int:
+        """Déplace plusieurs sous-arbres ; ignore ceux qui créeraient un cycle."""
+        moved = 0
+        with self.bulk():
+            for nid in node_ids:
+                if nid == "root" or self.is_descendant(nid, new_parent) or self._parent.get(nid) == new_parent:
+                    continue
+                self.move(nid, new_parent)
+                moved += 1
+        return moved
+
+    def recategorize(self, node_ids, category, recursive: bool = False) -> int:
+        """Applique une catégorie à plusieurs nœuds (et à leurs sous-arbres si recursive)."""
+        targets = []
+        seen = set()
+        for nid in node_ids:
+            for t in (self.subtree(nid) if recursive else [nid]):
+                if t not in seen and t != "root":
+                    seen.add(t)
+                    targets.append(t)
+        with self.bulk():
+            for t in targets:
+                self.relabel(t, category=category)
+        return len(targets)
+
+    def import_records(self, records, parent_id: str = "root") -> int:
+        """
+        Ajoute des nœuds importés [(clé, clé du parent ou None, libellé, catégorie)]
+        sous parent_id, parents avant enfants quel que soit l'ordre des lignes.
+        Les clés de parent inconnues rattachent à parent_id ; les cycles sont ignorés.
+        """
+        if parent_id not in self.nodes:
+            raise KeyError(parent_id)
+        keys = {r[0] for r in records}
+        by_parent = defaultdict(list)
+        for rec in records:
+            by_parent[rec[1] if rec[1] in keys else None].append(rec)
+        added = 0
+        with self.bulk():
+            queue = deque((rec, parent_id) for rec in by_parent[None])
+            while queue:
+                (key, _, label, category), target = queue.popleft()
+                nid = self.add_node(label, category, target)
+                added += 1
+                queue.extend((child, nid) for child in by_parent.pop(key, ()))
+        return added
+
+    # ---- interne ----
+    def _renumber(self):
+        """Parcours en profondeur itératif : tin/tout et effectifs par catégorie."""
+        tin, tout = {}, {}
+        order = []
+        clock = 0
+        roots = [nid for nid in self.nodes if nid not in self._parent]
+        for r in roots:
+            stack = [(r, False)]
+            while stack:
+                nid, done = stack.pop()
+                if done:
+                    tout[nid] = clock
+                    clock += 1
+                    continue
+                tin[nid] = clock
+                clock += 1
+                order.append(nid)
+                stack.append((nid, True))
+                stack.extend((c, False) for c in reversed(self._children.get(nid, ())))
+        # post-ordre : chaque nœud remonte ses effectifs (+ lui-même) au parent
+        counts = {nid: defaultdict(int) for nid in order}
+        for nid in reversed(order):
+            p = self._parent.get(nid)
+            if p is None:
+                continue
+            agg = counts[p]
+            for cat, n in counts[nid].items():
+                agg[cat] += n
+            agg[self.nodes[nid].get("category") or UNCATEGORIZED] += 1
+        self._tin, self._tout, self._counts = tin, tout, counts
+        self._dirty = False
+
+def build_children_map(edges):
+    children = defaultdict(list)
+    for src, tgt in edges:
+        children[src].append(tgt)
+    return children
+
+# =============== CACHE DE RENDU (Graphviz) ===============
+def build_digraph(nodes, edges) -> graphviz.Digraph:
+    dot = graphviz.Digraph("Arbre des Causes", format="png")
+    dot.attr(rankdir=RANKDIR)
+    for node_id, data in nodes.items():
+        label = data.get("label", node_id)
+        cat = data.get("category")
+        if data.get("summary"):
+            fill = CATEGORIES[cat]["color"] if cat in CATEGORIES else "white"
+            dot.node(node_id, label, shape="folder", style="filled,dashed", fillcolor=fill)
+        elif cat in CATEGORIES:
+            dot.node(node_id, label, style="filled", fillcolor=CATEGORIES[cat]["color"])
+        else:
+            dot.node(node_id, label)
+    for src, tgt in edges:
+        if ARROW_MODE == "PARENT_TO_CHILD":
+            dot.edge(src, tgt)
+        else:
+            dot.edge(tgt, src)
+    return dot
+
+def tree_render_key(nodes, edges) -> str:
+    """Hash stable du contenu affiché (nœuds, liens, résumés, orientation, couleurs)."""
+    payload = json.dumps(
+        [
+            [[nid, d.get("label", nid), d.get("category"), bool(d.get("summary"))] for nid, d in nodes.items()],
+            [list(e) for e in edges],
+            RANKDIR,
+            ARROW_MODE,
+            {cat: info["color"] for cat, info in CATEGORIES.items()},
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class RenderCache:
+    """
+    Cache LRU (partagé entre sessions) : hash du contenu -> source DOT,
+    et images rendues (svg/png) calculées à la demande.
+    Un arbre inchangé ne coûte qu'un calcul de hash.
+    Éviction LRU au-delà de maxsize entrées ou de max_bytes au total (DOT et
+    images d'un très grand arbre peuvent peser des dizaines de Mo) ; un DOT
+    ou une image dépassant à lui seul max_bytes n'est pas conservé.
+    """
+
+    def __init__(self, maxsize: int = 128, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> {"dot": str, <format>: bytes}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        self._bytes -= sum(len(v) for v in self._entries.pop(key).values())
+        self.evictions += 1
+
+    def _put(self, key, field: str, value) -> bool:
+        """
+        Ajoute un champ à l'entrée (créée au besoin), puis évince les plus anciennes
+        au-delà des limites. Si l'entrée seule dépasserait max_bytes, le champ n'est
+        pas conservé (une image trop lourde laisse le DOT en cache) et renvoie False.
+        """
+        entry = self._entries.get(key, {})
+        if sum(len(v) for f, v in entry.items() if f != field) + len(value) > self.max_bytes:
+            return False
+        self._entries[key] = entry
+        self._bytes += len(value) - len(entry.get(field, ""))
+        entry[field] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+        return True
+
+    def get_dot(self, nodes, edges):
+        """Renvoie (clé, source DOT) pour l'arbre donné."""
+        key = tree_render_key(nodes, edges)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return key, entry["dot"]
+            self.misses += 1
+        source = build_digraph(nodes, edges).source
+        with self._lock:
+            self._put(key, "dot", source)
+        return key, source
+
+    def get_image(self, nodes, edges, fmt: str = "png") -> bytes:
+        """Image rendue par Graphviz (nécessite l'exécutable `dot`)."""
+        key, source = self.get_dot(nodes, edges)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and fmt in entry:
+                return entry[fmt]
+        with current_profile().span("graphviz.layout"):
+            data = graphviz.Source(source).pipe(format=fmt)
+        with self._lock:
+            if key in self._entries or self._put(key, "dot", source):
+                self._put(key, fmt, data)
+        return data
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+# =============== AFFICHAGE PAR NIVEAU (grands arbres) ===============
+SUMMARY_PREFIX = "__summary__"
+
+def build_lod_view(tree: TreeStore, focus: str = "root", max_depth: int = 2,
+                   expanded=(), collapsed=()):
+    """
+    Vue partielle de l'arbre : sous-arbre de `focus` jusqu'à `max_depth` niveaux.
+    Une branche repliée est remplacée par un nœud résumé (effectifs par catégorie)
+    rattaché au nœud replié. `expanded` / `collapsed` forcent l'état d'une branche.
+    Coût proportionnel au nombre de nœuds visibles.
+    Renvoie (nodes, edges, repliables) au format attendu par build_digraph.
+    """
+    expanded, collapsed = set(expanded), set(collapsed)
+    nodes, edges, foldable = {}, [], []
+    q = deque([(focus, 0)])
+    while q:
+        nid, depth = q.popleft()
+        nodes[nid] = tree.nodes[nid]
+        kids = tree.children(nid)
+        if not kids:
+            continue
+        foldable.append(nid)
+        is_open = nid in expanded or (depth < max_depth and nid not in collapsed)
+        if is_open:
+            for c in kids:
+                edges.append((nid, c))
+                q.append((c, depth + 1))
+            continue
+        counts = tree.subtree_counts(nid)
+        total = sum(counts.values())
+        lines = [f"+{total} cause(s)"]
+        lines += [f"{cat} : {n}" for cat, n in counts.items() if n]
+        sid = f"{SUMMARY_PREFIX}{nid}"
+        nodes[sid] = {
+            "label": "\\n".join(lines),
+            "category": max(counts, key=counts.get) if counts else None,
+            "summary": True,
+        }
+        edges.append((nid, sid))
+    return nodes, edges, foldable
+
+# =============== EXPORT WORD ===============
+EXPORT_INDENT_TWIPS = 360           # retrait par niveau du plan
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def iter_tree_outline(nodes, edges, root_id: str = "root"):
+    """Parcours en profondeur (un seul passage) : (profondeur, id) dans l'ordre des liens."""
+    children = build_children_map(edges)
+    visited = set()
+    stack = [(root_id, 0)] if root_id in nodes else []
+    while stack:
+        nid, depth = stack.pop()
+        visited.add(nid)
+        yield depth, nid
+        stack.extend((c, depth + 1) for c in reversed(children.get(nid, ())))
+    # nœuds non rattachés à la racine (ne devrait pas arriver) : en fin de plan
+    for nid in nodes:
+        if nid not in visited:
+            yield 0, nid
+
+def outline_xml(items) -> str:
+    """
+    Paragraphes WordprocessingML d'un plan à puces, générés en bloc.
+    items : (profondeur, texte, suffixe, couleur hex ou None).
+    """
+    out = []
+    for depth, text, suffix, color in items:
+        ind = EXPORT_INDENT_TWIPS * (depth + 1)
+        run = f'<w:r><w:t xml:space="preserve">{xml_escape(_XML_INVALID.sub("", text))}</w:t></w:r>'
+        if suffix:
+            rpr = f'<w:rPr><w:color w:val="{color.lstrip("#")}"/></w:rPr>' if color else ""
+            run += f'<w:r>{rpr}<w:t xml:space="preserve">{xml_escape(_XML_INVALID.sub("", suffix))}</w:t></w:r>'
+        out.append(
+            '<w:p><w:pPr><w:pStyle w:val="ListBullet"/>'
+            f'<w:ind w:left="{ind}" w:hanging="{EXPORT_INDENT_TWIPS}"/></w:pPr>{run}</w:p>'
+        )
+    return "".join(out)
+
+def append_outline(doc, items):
+    """Insère tout le plan d'un coup (un seul parse XML) avant la section finale."""
+    body = doc.element.body
+    fragment = parse_xml(f"<w:body {nsdecls('w')}>{outline_xml(items)}</w:body>")
+    pos = len(body) - 1 if body.sectPr is not None else len(body)
+    body[pos:pos] = list(fragment)
+
+def _save_docx(doc) -> BytesIO:
+    buf = BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    return buf
+
+def export_arbre_docx(title, nodes, edges, image: bytes = None) -> BytesIO:
+    """Arbre en plan hiérarchique indenté ; `image` (png) : schéma inséré avant le plan."""
+    doc = Document()
+    doc.add_heading(title or "Arbre des causes", 0)
+
+    doc.add_heading("Catégories", level=1)
+    for cat, info in CATEGORIES.items():
+        doc.add_paragraph(f"- {cat} : {info['desc']}")
+
+    if image:
+        doc.add_heading("Schéma", level=1)
+        doc.add_picture(BytesIO(image), width=Inches(6.5))
+
+    doc.add_heading("Arbre (Parent → Enfant)", level=1)
+    items = []
+    for depth, nid in iter_tree_outline(nodes, edges):
+        data = nodes[nid]
+        cat = data.get("category")
+        color = CATEGORIES[cat]["color"] if cat in CATEGORIES else None
+        items.append((depth, data.get("label", ""), f" ({cat or 'Non défini'})", color))
+    append_outline(doc, items)
+    return _save_docx(doc)
+
+def export_why_docx(problem: str, whys) -> BytesIO:
+    """5 Pourquoi : chaque réponse est indentée sous la précédente (chaîne causale)."""
+    doc = Document()
+    doc.add_heading("Analyse 5 Pourquoi", 0)
+    if problem:
+        doc.add_paragraph(f"Problème observé : {problem}")
+    answered = [(i, ans.strip()) for i, ans in enumerate(whys, 1) if ans.strip()]
+    items = [(depth, f"{i}. Pourquoi ? — {ans}", None, None) for depth, (i, ans) in enumerate(answered)]
+    append_outline(doc, items)
+    return _save_docx(doc)
+
+# -------- Extraction texte .docx (paragraphes + tableaux) --------
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P, _W_TBL, _W_TR, _W_TC = W_NS + "p", W_NS + "tbl", W_NS + "tr", W_NS + "tc"
+_W_T, _W_TAB, _W_BR, _W_CR = W_NS + "t", W_NS + "tab", W_NS + "br", W_NS + "cr"
+_W_TXBX, _W_PAGE_BREAK = W_NS + "txbxContent", W_NS + "lastRenderedPageBreak"
+
+def _paragraph_text(p, after_hard: bool = False) -> tuple:
+    """
+    (morceaux, after_hard) d'un <w:p>, zones de texte exclues : le texte découpé
+    aux sauts de page (un morceau par page touchée, le premier sur la page courante).
+    Word écrit un lastRenderedPageBreak au début de la page qui suit un saut manuel
+    (<w:br w:type="page">) : il n'est compté que s'il ne suit pas un saut manuel
+    (`after_hard`, reporté d'un paragraphe à l'autre).
+    """
+    parts, out = [], []
+    stack = [p]
+    while stack:
+        el = stack.pop()
+        tag = el.tag
+        if tag == _W_TXBX:
+            continue
+        if tag == _W_T:
+            if el.text:
+                out.append(el.text)
+                after_hard = False
+        elif tag == _W_TAB:
+            out.append("\t")
+            after_hard = False
+        elif tag == _W_BR:
+            if el.get(W_NS + "type") == "page":
+                parts.append("".join(out))
+                out = []
+                after_hard = True
+            else:
+                out.append("\n")
+        elif tag == _W_CR:
+            out.append("\n")
+        elif tag == _W_PAGE_BREAK:
+            if not after_hard:
+                parts.append("".join(out))
+                out = []
+            after_hard = False
+        stack.extend(reversed(el))
+    parts.append("".join(out))
+    return parts, after_hard
+
+def iter_docx_text(file, max_chars: int = None, pages: tuple = None):
+    """
+    Extraction en flux de word/document.xml : renvoie, dans l'ordre du document,
+    le texte de chaque paragraphe et de chaque ligne de tableau (cellules séparées
+    par tabulation). Chaque élément est libéré dès qu'il a été lu : la mémoire
+    reste bornée par la taille d'un paragraphe / d'une ligne.
+    - max_chars : arrêt dès que ce nombre de caractères a été produit
+    - pages : (première, dernière) incluses, d'après les sauts de page
+      enregistrés par Word (approximatif) ; None = tout le document
+    """
+    first_page, last_page = pages if pages else (1, None)
+    page = 1
+    row_page = 1        # page où commence la ligne de tableau en cours
+    after_hard = False  # dernier saut vu : manuel, sans texte depuis
+    produced = 0
+    stack = []          # éléments ouverts (pour détacher les éléments traités)
+    tbl_depth = 0
+    p_depth = 0
+    cell, row = [], []
+
+    with zipfile.ZipFile(file) as zf, zf.open("word/document.xml") as xml:
+        for event, el in ET.iterparse(xml, events=("start", "end")):
+            tag = el.tag
+            if event == "start":
+                stack.append(el)
+                if tag == _W_TBL:
+                    tbl_depth += 1
+                elif tag == _W_P:
+                    p_depth += 1
+                elif tag == _W_TR and tbl_depth == 1:
+                    row_page = page
+                continue
+
+            stack.pop()
+            text = None
+            in_range = True     # paragraphe : morceaux déjà filtrés par page
+            if tag == _W_P:
+                p_depth -= 1
+                if p_depth:
+                    continue   # paragraphe imbriqué (zone de texte) : ignoré
+                parts, after_hard = _paragraph_text(el, after_hard)
+                if tbl_depth:
+                    txt = "".join(parts).strip()
+                    if txt:
+                        cell.append(txt)
+                else:
+                    # chaque morceau est filtré sur sa propre page
+                    kept = [
+                        t.strip() for i, t in enumerate(parts)
+                        if first_page <= page + i and (last_page is None or page + i <= last_page)
+                    ]
+                    text = "\n".join(t for t in kept if t)
+                page += len(parts) - 1
+            elif tag == _W_TC and tbl_depth == 1:
+                row.append("\n".join(cell))
+                cell = []
+            elif tag == _W_TR and tbl_depth == 1:
+                text = "\t".join(c for c in row if c)
+                in_range = first_page <= row_page and (last_page is None or row_page <= last_page)
+                row = []
+            elif tag == _W_TBL:
+                tbl_depth -= 1
+            else:
+                continue
+
+            # libérer l'élément traité (dernier enfant de son parent)
+            el.clear()
+            if stack and len(stack[-1]) and stack[-1][-1] is el:
+                del stack[-1][-1]
+
+            if text and in_range:
+                if max_chars is not None:
+                    remaining = max_chars - produced
+                    if remaining <= 0:
+                        return
+                    text = text[:remaining]
+                produced += len(text) + 1
+                yield text
+            if last_page is not None and page > last_page:
+                return
+
+def extract_docx_text(file_bytes: BytesIO, max_chars: int = None, pages: tuple = None) -> str:
+    prof = current_profile()
+    with prof.span("docx.extract"):
+        text = "\n".join(iter_docx_text(file_bytes, max_chars=max_chars, pages=pages)).strip()
+    prof.gauge("docx.chars", len(text))
+    return text
+
+# -------- IA: OpenAI (questions profondes) ou heuristique locale --------
+AI_MODEL = "gpt-4o-mini"
+AI_TEMPERATURE = 0.2
+AI_PROMPT_VERSION = 1        # à incrémenter à chaque modification de _ai_messages
+HEURISTIC_MODEL = "heuristique-locale"
+
+# -------- Cache disque des questions générées --------
+AI_CACHE_PATH = os.environ.get("ARBRE_AI_CACHE", os.path.join(".arbre_cache", "ai_questions.sqlite"))
+AI_CACHE_TTL = 7 * 24 * 3600           # secondes
+AI_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+def normalize_text(text: str) -> str:
+    """Normalisation pour la clé de cache : NFC, espaces réduits."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+class QuestionCache:
+    """
+    Cache SQLite (partagé entre sessions et redémarrages) des blocs de questions.
+    Clé = hash(texte normalisé, modèle, version du prompt, température).
+    Expiration par TTL, éviction LRU quand la taille totale dépasse max_bytes.
+    """
+
+    def __init__(self, path: str = AI_CACHE_PATH, ttl: float = AI_CACHE_TTL,
+                 max_bytes: int = AI_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ai_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ai_cache_lru ON ai_cache(last_access)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str, prompt_version=AI_PROMPT_VERSION,
+                 temperature: float = AI_TEMPERATURE) -> str:
+        payload = json.dumps([normalize_text(text), model, prompt_version, temperature],
+                             ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, size, created FROM ai_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] + self.ttl < now:
+                if row is not None:
+                    self._db.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE ai_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            self.bytes_saved += row[1]
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, value, size, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._db.execute("DELETE FROM ai_cache WHERE created < ?", (now - self.ttl,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # éviction LRU : les moins récemment lus d'abord
+                for old_key, old_size in self._db.execute(
+                    "SELECT key, size FROM ai_cache ORDER BY last_access"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM ai_cache WHERE key = ?", (old_key,))
+                    total -= old_size
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM ai_cache")
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ai_cache"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+                "entries": entries,
+                "bytes": total,
+            }
+
+def _ai_messages(text: str):
+    system = (
+        "Tu es un expert HSE. Tu vas proposer UNIQUEMENT des QUESTIONS d'enquête "
+        "ouvertes, précises, actionnables, classées par thèmes. Réponds en texte clair."
+    )
+    user = f"""
+Analyse le recueil d'effets ci-dessous (accident du travail). 
+Produis un texte prêt à copier-coller (pas de JSON), avec des sections par thème et des puces.
+
+Thèmes attendus (si pertinents) :
+- Chronologie
+- Organisation
+- Humain
+- Technique
+- Environnement
+- Barrières/Contrôles
+
+Pour chaque question :
+- Formulation ouverte et précise
+- Si utile, ajoute entre parenthèses une piste de "preuves attendues" (documents/observations).
+
+Recueil d'effets:
+\"\"\"{text}\"\"\"
+"""
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": user}]
+
+def _warn(on_warning, message: str):
+    if on_warning is not None:
+        on_warning(message)
+    else:
+        logger.warning(message)
+
+# -------- IA : client partagé, file d'attente commune et limitation de débit --------
+AI_BASE_URL = os.environ.get("ARBRE_AI_BASE_URL") or os.environ.get("OPENAI_BASE_URL") or None
+AI_MAX_CONCURRENCY = int(os.environ.get("ARBRE_AI_CONCURRENCY", "4"))  # requêtes en cours (processus)
+AI_RATE_PER_MINUTE = float(os.environ.get("ARBRE_AI_RATE", "60"))      # 0 = pas de limite de débit
+AI_RATE_BURST = int(os.environ.get("ARBRE_AI_BURST", "5"))
+AI_MAX_RETRIES = 4
+AI_BACKOFF_BASE = 1.0        # secondes, doublé à chaque tentative (avec gigue)
+AI_BACKOFF_MAX = 30.0
+AI_QUEUE_TIMEOUT = 300.0     # attente maximale dans la file avant repli local
+AI_HTTP_TIMEOUT = 120.0
+
+class TokenBucket:
+    """
+    Seau à jetons : `rate` jetons par seconde, au plus `capacity` en réserve.
+    Les jetons sont réservés (solde négatif possible) : chaque appelant connaît
+    son attente et les appels sont servis dans l'ordre de réservation.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self) -> float:
+        """Prend un jeton ; renvoie l'attente (secondes) avant de pouvoir l'utiliser."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def pause(self, seconds: float):
+        """Aucun jeton disponible pendant `seconds` (limite de débit signalée par l'API)."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+class AIRequestQueue:
+    """
+    File d'attente commune (toutes sessions) des appels au LLM : admission dans
+    l'ordre d'arrivée, au plus `max_concurrency` requêtes en cours, débit limité
+    par un seau à jetons. `slot(on_position)` bloque jusqu'à l'admission en
+    signalant la position d'attente (1 = prochain servi, 0 = admis).
+    """
+
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 rate_per_minute: float = AI_RATE_PER_MINUTE, burst: int = AI_RATE_BURST):
+        self.max_concurrency = max(1, max_concurrency)
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._active = 0
+        self.served = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+
+    @contextmanager
+    def slot(self, on_position=None, timeout: float = AI_QUEUE_TIMEOUT):
+        ticket = object()
+        deadline = time.monotonic() + timeout
+        reported = None
+        with self._cond:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    position = self._waiting.index(ticket) + 1
+                    if position == 1 and self._active < self.max_concurrency:
+                        self._waiting.popleft()
+                        self._active += 1
+                        self._cond.notify_all()     # le suivant peut être admis aussi
+                        break
+                    if position == reported:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise TimeoutError(f"file d'attente IA saturée ({len(self._waiting)} en attente)")
+                        self._cond.wait(min(remaining, 1.0))
+                        continue
+                # rappel hors verrou (il peut mettre à jour l'interface)
+                reported = position
+                if on_position is not None:
+                    on_position(position)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+            raise
+        try:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+            if reported is not None and on_position is not None:
+                on_position(0)
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self.served += 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "served": self.served,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "timeouts": self.timeouts,
+            }
+
+_ai_shared = {}
+_ai_shared_lock = threading.Lock()
+
+def get_ai_queue() -> AIRequestQueue:
+    """File d'attente unique du processus."""
+    with _ai_shared_lock:
+        if "queue" not in _ai_shared:
+            _ai_shared["queue"] = AIRequestQueue()
+        return _ai_shared["queue"]
+
+def get_openai_client(api_key: str, base_url: str = None):
+    """
+    Client OpenAI unique du processus (pool de connexions HTTP partagé par les
+    sessions), recréé seulement si la clé ou l'URL change. Les nouvelles tentatives
+    sont gérées par ai_questions_stream (max_retries=0) pour passer par la file.
+    Les limites du pool sont construites avec la classe du SDK installé (httpx ou
+    httpx2 selon la version d'openai), sans importer le client HTTP directement.
+    """
+    with _ai_shared_lock:
+        client = _ai_shared.get("client")
+        if client is None or _ai_shared.get("client_key") != (api_key, base_url):
+            from openai import DEFAULT_CONNECTION_LIMITS, OpenAI, DefaultHttpxClient
+            limit = AI_MAX_CONCURRENCY
+            limits = type(DEFAULT_CONNECTION_LIMITS)(max_connections=limit * 2, max_keepalive_connections=limit)
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                timeout=AI_HTTP_TIMEOUT,
+                http_client=DefaultHttpxClient(limits=limits),
+            )
+            _ai_shared["client"], _ai_shared["client_key"] = client, (api_key, base_url)
+        return client
+
+def _retry_policy(error, attempt: int):
+    """(nouvelle tentative ?, limite de débit ?, délai en secondes) pour une erreur de l'API."""
+    try:
+        import openai
+    except ImportError:
+        return False, False, 0.0
+    rate_limited = isinstance(error, openai.RateLimitError)
+    if not (rate_limited or isinstance(error, (openai.APIConnectionError, openai.InternalServerError))):
+        return False, False, 0.0
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+    if retry_after is None:
+        retry_after = random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2 ** attempt))   # gigue complète
+    return attempt < AI_MAX_RETRIES, rate_limited, min(retry_after, AI_BACKOFF_MAX)
+
+def ai_questions_stream(text: str, cache: QuestionCache = None, on_warning=None, on_queue=None):
+    """
+    Version en flux de ai_questions_only : renvoie le bloc de questions morceau
+    par morceau (tokens OpenAI, ou lignes de l'heuristique locale en repli).
+    Avec `cache`, un résultat déjà calculé est renvoyé d'un bloc et une réponse
+    complète est mémorisée (jamais un repli ni une réponse partielle).
+    `on_warning(message)` reçoit les avertissements (par défaut : logging) ;
+    `on_queue(position)` la position dans la file d'attente commune (0 = admis).
+    """
+    prof = current_profile()
+    api_key = os.environ.get("OPENAI_API_KEY")
+    base_url = AI_BASE_URL      # lu une fois : même URL pour le client et la clé du cache
+    if not api_key:
+        model = f"{HEURISTIC_MODEL}:{get_heuristic_engine().version}"
+    else:
+        model = f"{AI_MODEL}@{base_url}" if base_url else AI_MODEL
+    key = QuestionCache.make_key(text, model) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            prof.count("llm.cache_hits")
+            yield cached
+            return
+    parts = []
+    if not api_key:
+        with prof.span("llm.heuristic"):
+            for line in heuristic_questions_stream(text):
+                parts.append(line)
+                yield line
+        if key is not None:
+            cache.put(key, "".join(parts))
+        return
+    produced = False
+    queue = get_ai_queue()
+    attempt = 0
+    while True:
+        try:
+            client = get_openai_client(api_key, base_url)
+            t_queue = time.perf_counter()
+            with queue.slot(on_position=on_queue):
+                prof.count("llm.queue_s", time.perf_counter() - t_queue)
+                prof.count("llm.calls")
+                t0 = time.perf_counter()
+                stream = client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=_ai_messages(text),
+                    temperature=AI_TEMPERATURE,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None:
+                        prof.count("llm.prompt_tokens", usage.prompt_tokens or 0)
+                        prof.count("llm.completion_tokens", usage.completion_tokens or 0)
+                    if delta:
+                        if not produced:
+                            prof.count("llm.first_token_s", time.perf_counter() - t0)
+                        produced = True
+                        prof.count("llm.chunks")
+                        parts.append(delta)
+                        yield delta
+                prof.count("llm.latency_s", time.perf_counter() - t0)
+            if key is not None and parts:
+                cache.put(key, "".join(parts))
+            return
+        except Exception as e:
+            if produced:
+                _warn(on_warning, f"IA OpenAI interrompue ({e}). Réponse partielle conservée.")
+                return
+            retry, rate_limited, delay = _retry_policy(e, attempt)
+            if retry:
+                # la place dans la file est rendue pendant l'attente
+                if rate_limited:
+                    queue.rate_limited += 1
+                    queue.bucket.pause(delay)
+                queue.retries += 1
+                prof.count("llm.retries")
+                attempt += 1
+                time.sleep(delay)
+                continue
+            prof.count("llm.errors")
+            _warn(on_warning, f"IA OpenAI indisponible ({e}). Passage en mode local.")
+            yield from heuristic_questions_stream(text)
+            return
+
+def ai_questions_only(text: str, cache: QuestionCache = None, on_warning=None, on_queue=None) -> str:
+    """
+    Renvoie un seul bloc de texte (markdown simple) à copier-coller,
+    contenant des QUESTIONS d’enquête profondes, organisées par thèmes.
+    """
+    return "".join(ai_questions_stream(text, cache=cache, on_warning=on_warning, on_queue=on_queue)).strip()
+
+def heuristic_questions_stream(text: str):
+    """Heuristique locale, ligne par ligne (même interface que ai_questions_stream)."""
+    for line in heuristic_questions_text(text).splitlines(keepends=True):
+        yield line
+
+# -------- Heuristique locale : moteur de règles (heuristic_rules.json) --------
+HEURISTIC_RULES_PATH = os.environ.get(
+    "ARBRE_HEURISTIC_RULES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "heuristic_rules.json"),
+)
+
+# marques combinantes (accents après décomposition NFD), plan multilingue de base
+_COMBINING_RE = re.compile(
+    "[" + "".join(re.escape(chr(c)) for c in range(0x300, 0x10000) if unicodedata.combining(chr(c))) + "]"
+)
+
+def fold_text(text: str) -> str:
+    """Minuscules, sans accents, apostrophes unifiées, espaces réduits (comparaison de mots-clés)."""
+    t = (text or "").lower().replace("’", "'")
+    if not t.isascii():
+        t = _COMBINING_RE.sub("", unicodedata.normalize("NFD", t))
+    return " ".join(t.split())
+
+def _trie_regex(words, prefixes: dict = None) -> str:
+    """
+    Expression régulière factorisée (trie) : une seule passe, plus long mot d'abord.
+    Si `prefixes` est fourni, il reçoit pour chaque mot la liste des mots qui en sont
+    des préfixes (lui compris, du plus court au plus long), relevée en parcourant le trie.
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node, path="", ended=()) -> str:
+        end = "" in node
+        if end:
+            ended = ended + (path,)
+            if prefixes is not None:
+                prefixes[path] = list(ended)
+        alts = [re.escape(ch) + build(sub, path + ch, ended) for ch, sub in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if end:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+class HeuristicRuleEngine:
+    """
+    Règles mot-clé -> questions par thème, chargées depuis un fichier JSON :
+    - "themes" : ordre des sections
+    - "base" : questions toujours proposées, par thème
+    - "rules" : [{"id", "keywords", "questions": {thème: [...]}, "whole_word"?}]
+    Tous les mots-clés sont compilés en une seule expression (trie) évaluée en une
+    passe sur le texte replié (sans accents), en lecture anticipée à chaque début
+    de mot : les correspondances qui se chevauchent (« hauteur » dans « chute de
+    hauteur ») sont toutes vues. Un mot-clé correspond à un début de mot
+    (préfixe, ex. « autorout ») ou au mot entier si "whole_word" est vrai.
+    """
+
+    def __init__(self, config: dict):
+        self.themes = list(config.get("themes") or AI_THEMES)
+        self.base = {t: list(qs) for t, qs in config.get("base", {}).items()}
+        self.rules = list(config.get("rules", []))
+        # empreinte du jeu de règles (clé du cache des questions heuristiques)
+        self.version = hashlib.sha256(
+            json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:12]
+        # mot-clé replié -> [(index de règle, mot entier ?)]
+        by_kw = defaultdict(list)
+        for idx, rule in enumerate(self.rules):
+            for kw in rule.get("keywords", []):
+                fk = fold_text(kw)
+                if fk:
+                    by_kw[fk].append((idx, bool(rule.get("whole_word"))))
+        self._by_kw = dict(by_kw)
+        # la regex renvoie le mot-clé le plus long : ses préfixes qui sont aussi
+        # des mots-clés doivent déclencher leurs règles (relevés sur le trie)
+        self._prefixes = {}
+        self._pattern = (
+            re.compile(r"(?<!\w)(?=(" + _trie_regex(self._by_kw, self._prefixes) + "))") if self._by_kw else None
+        )
+        self._lock = threading.Lock()
+        self._evaluations = 0
+        self._rule_hits = defaultdict(int)
+        self._keyword_hits = defaultdict(int)
+
+    @classmethod
+    def from_file(cls, path: str = HEURISTIC_RULES_PATH) -> "HeuristicRuleEngine":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def match(self, text: str) -> dict:
+        """Règles déclenchées : {id de règle: nb d'occurrences} (une passe sur le texte)."""
+        fired = defaultdict(int)
+        kw_hits = defaultdict(int)
+        if self._pattern is not None:
+            folded = fold_text(text)
+            for m in self._pattern.finditer(folded):
+                start = m.start()
+                for kw in self._prefixes[m.group(1)]:
+                    end = start + len(kw)
+                    for idx, whole in self._by_kw[kw]:
+                        if whole and end < len(folded) and (folded[end].isalnum() or folded[end] == "_"):
+                            continue
+                        fired[self.rules[idx].get("id", str(idx))] += 1
+                        kw_hits[kw] += 1
+        with self._lock:
+            self._evaluations += 1
+            for rid, n in fired.items():
+                self._rule_hits[rid] += n
+            for kw, n in kw_hits.items():
+                self._keyword_hits[kw] += n
+        return dict(fired)
+
+    def questions(self, text: str) -> dict:
+        """{thème: [questions]} : base puis questions des règles déclenchées."""
+        out = {t: list(self.base.get(t, [])) for t in self.themes}
+        fired = self.match(text)
+        for idx, rule in enumerate(self.rules):
+            if rule.get("id", str(idx)) not in fired:
+                continue
+            for theme, qs in rule.get("questions", {}).items():
+                out.setdefault(theme, []).extend(qs)
+        return out
+
+    def render(self, text: str) -> str:
+        out = []
+        for title, qs in self.questions(text).items():
+            if not qs:
+                continue
+            out.append(f"### {title}")
+            out.extend(f"- {q}" for q in qs)
+            out.append("")
+        return "\n".join(out).strip()
+
+    def stats(self) -> dict:
+        """Statistiques cumulées : nb d'évaluations, déclenchements par règle et par mot-clé."""
+        with self._lock:
+            return {
+                "evaluations": self._evaluations,
+                "rules": dict(sorted(self._rule_hits.items(), key=lambda kv: -kv[1])),
+                "keywords": dict(sorted(self._keyword_hits.items(), key=lambda kv: -kv[1])),
+            }
+
+_heuristic_engine = None
+_heuristic_engine_lock = threading.Lock()
+
+def get_heuristic_engine() -> HeuristicRuleEngine:
+    """Moteur partagé, chargé une fois depuis HEURISTIC_RULES_PATH."""
+    global _heuristic_engine
+    if _heuristic_engine is None:
+        with _heuristic_engine_lock:
+            if _heuristic_engine is None:
+                _heuristic_engine = HeuristicRuleEngine.from_file(HEURISTIC_RULES_PATH)
+    return _heuristic_engine
+
+def heuristic_questions_text(text: str) -> str:
+    """Fallback local: questions par thèmes (pas juste paraphrase)."""
+    return get_heuristic_engine().render(text)
+
+# -------- Quasi-doublons : MinHash (une permutation) + LSH --------
+NEAR_DUP_THRESHOLD = 0.7     # similarité de Jaccard minimale (shingles de caractères)
+_NON_WORD = re.compile(r"[^0-9a-z ]+")
+_HASH_MAX = 1 << 32
+
+def question_shingles(text: str, size: int = 4) -> frozenset:
+    """Shingles de caractères du texte replié (accents, casse et ponctuation ignorés)."""
+    t = " ".join(_NON_WORD.sub(" ", fold_text(text)).split())
+    if len(t) <= size:
+        return frozenset([t]) if t else frozenset()
+    return frozenset(t[i:i + size] for i in range(len(t) - size + 1))
+
+class NearDuplicateIndex:
+    """
+    Index de quasi-doublons. Signature MinHash « une permutation » (un hachage
+    par shingle, réparti en num_perm compartiments, complétés par densification),
+    découpée en bandes de `rows` valeurs pour la recherche LSH.
+    Par défaut, `rows` est choisi pour que le seuil effectif du LSH, (1/bandes)^(1/rows),
+    soit le plus proche de `threshold` - LSH_MARGIN : les paires nettement sous le
+    seuil ne deviennent presque jamais candidates. Les candidats sont classés par
+    nombre de bandes partagées et au plus `max_candidates` sont confirmés par le
+    Jaccard exact : coût quasi linéaire en nombre de textes.
+    """
+
+    LSH_MARGIN = 0.1
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, shingle_size: int = 4,
+                 num_perm: int = 128, rows: int = None, max_candidates: int = 50):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.rows = rows or self._auto_rows(threshold, num_perm)
+        self.max_candidates = max_candidates
+        self._shingles = {}                 # clé -> shingles
+        self._texts = {}                    # clé -> texte d'origine
+        self._bands_of = {}                 # clé -> bandes (pour remove)
+        self._buckets = defaultdict(dict)   # (bande, valeurs) -> {clé: None} (ordre d'ajout)
+
+    def __len__(self):
+        return len(self._shingles)
+
+    @classmethod
+    def _auto_rows(cls, threshold: float, num_perm: int) -> int:
+        target = threshold - cls.LSH_MARGIN
+        return min(range(1, num_perm + 1), key=lambda r: abs((1.0 / (num_perm // r)) ** (1.0 / r) - target))
+
+    def _signature(self, shingles):
+        k = self.num_perm
+        bins = [_HASH_MAX] * k
+        for sh in shingles:
+            h = zlib.crc32(sh.encode("utf-8"))
+            i = h % k
+            v = h // k
+            if v < bins[i]:
+                bins[i] = v
+        # densification : un compartiment vide reprend le suivant non vide
+        if _HASH_MAX in bins and any(b != _HASH_MAX for b in bins):
+            for i in range(k):
+                j, step = i, 0
+                while bins[j] == _HASH_MAX:
+                    j = (j + 1) % k
+                    step += 1
+                if step:
+                    bins[i] = bins[j] + step * _HASH_MAX
+        return bins
+
+    def _bands(self, sig):
+        # bandes entrelacées (pas = nombre de bandes) : la densification recopie un
+        # compartiment dans ses voisins vides, des valeurs contiguës seraient corrélées
+        n = len(sig) // self.rows
+        return [(b, tuple(sig[b:n * self.rows:n])) for b in range(n)]
+
+    def prepare(self, text: str):
+        """(shingles, bandes LSH) d'un texte, réutilisables entre find et add."""
+        sh = question_shingles(text, self.shingle_size)
+        return sh, (self._bands(self._signature(sh)) if sh else [])
+
+    def find(self, text: str, prepared=None, first: bool = False):
+        """
+        [(clé, texte, similarité)] des entrées au-dessus du seuil, meilleure d'abord.
+        first=True : s'arrête au premier quasi-doublon trouvé.
+        """
+        sh, bands = prepared or self.prepare(text)
+        if not sh:
+            return []
+        shared = Counter()              # clé -> nb de bandes partagées
+        for band in bands:
+            bucket = self._buckets.get(band)
+            if bucket:
+                shared.update(bucket.keys())
+        candidates = shared
+        if len(shared) > self.max_candidates:
+            candidates = [key for key, _ in shared.most_common(self.max_candidates)]
+        found = []
+        size = len(sh)
+        for key in candidates:
+            other = self._shingles[key]
+            # Jaccard <= petite taille / grande taille : filtre sans intersection
+            if min(size, len(other)) < self.threshold * max(size, len(other)):
+                continue
+            inter = len(sh & other)
+            sim = inter / (size + len(other) - inter)
+            if sim >= self.threshold:
+                found.append((key, self._texts[key], sim))
+                if first:
+                    return found
+        found.sort(key=lambda x: -x[2])
+        return found
+
+    def add(self, key, text: str, prepared=None):
+        sh, bands = prepared or self.prepare(text)
+        if not sh or key in self._shingles:
+            return
+        self._shingles[key] = sh
+        self._texts[key] = text
+        self._bands_of[key] = bands
+        for band in bands:
+            self._buckets[band][key] = None
+
+    def remove(self, key):
+        """Retire une entrée (sans effet si la clé est absente)."""
+        if self._shingles.pop(key, None) is None:
+            return
+        del self._texts[key]
+        for band in self._bands_of.pop(key):
+            bucket = self._buckets[band]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[band]
+
+    def add_if_new(self, key, text: str):
+        """Ajoute si aucun quasi-doublon ; renvoie None, ou le (clé, texte, similarité) trouvé."""
+        prepared = self.prepare(text)
+        found = self.find(text, prepared, first=True)
+        if found:
+            return found[0]
+        self.add(key, text, prepared)
+        return None
+
+def dedupe_near(questions, threshold: float = NEAR_DUP_THRESHOLD, existing=None):
+    """
+    Retire les quasi-doublons d'une liste (première occurrence conservée).
+    `existing` : NearDuplicateIndex déjà rempli (ex. libellés de l'arbre).
+    Renvoie (gardées, [(question écartée, texte similaire, similarité)]).
+    """
+    index = NearDuplicateIndex(threshold)
+    kept, dropped = [], []
+    for i, q in enumerate(questions):
+        prepared = index.prepare(q)
+        match = []
+        if existing is not None:
+            same = (existing.shingle_size, existing.num_perm, existing.rows) == \
+                (index.shingle_size, index.num_perm, index.rows)
+            match = existing.find(q, prepared if same else None, first=True)
+        if not match:
+            match = index.find(q, prepared, first=True)
+        if match:
+            dropped.append((q, match[0][1], match[0][2]))
+            continue
+        index.add(i, q, prepared)
+        kept.append(q)
+    return kept, dropped
+
+class TreeLabelIndex(NearDuplicateIndex):
+    """
+    Index de quasi-doublons des libellés d'un TreeStore (clé = id du nœud), tenu
+    à jour par abonnement aux événements de l'arbre comme NodeSearchIndex.
+    close() le désabonne quand il est remplacé (autre seuil, autre arbre).
+    """
+
+    def __init__(self, tree: TreeStore, threshold: float = NEAR_DUP_THRESHOLD):
+        super().__init__(threshold)
+        self.tree = tree
+        for nid, data in tree.nodes.items():
+            self.add(nid, data.get("label", ""))
+        tree.subscribe(self._on_change)
+
+    def _on_change(self, tree, event, payload):
+        for ev, nid in (payload if event == "bulk" else [(event, payload)]):
+            if ev == "move":
+                continue
+            self.remove(nid)
+            if ev != "delete" and nid in tree.nodes:
+                self.add(nid, tree.nodes[nid].get("label", ""))
+
+    def close(self):
+        self.tree.unsubscribe(self._on_change)
+
+# -------- Parseur des questions (depuis le bloc texte IA) --------
+class QuestionDetector:
+    """
+    Détection incrémentale des puces/questions dans un bloc texte IA reçu par morceaux.
+    Règles: lignes commençant par -, *, • (avec ou sans espace), et/ou finissant par ?.
+    Ignore les titres (### ...). Le dédoublonnage est conservé d'un morceau à l'autre ;
+    avec `near_threshold`, les quasi-doublons (reformulations) sont aussi écartés.
+    """
+
+    def __init__(self, near_threshold: float = None):
+        self.questions = []
+        self.near_duplicates = []   # (question écartée, question gardée, similarité)
+        self._seen = set()
+        self._near = NearDuplicateIndex(near_threshold) if near_threshold else None
+        self._buffer = ""
+
+    def feed(self, chunk: str):
+        """Ajoute un morceau ; renvoie les nouvelles questions des lignes complètes."""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._consume(lines)
+
+    def finish(self):
+        """Traite la dernière ligne (sans saut de ligne final)."""
+        rest, self._buffer = self._buffer, ""
+        return self._consume([rest])
+
+    def _consume(self, lines):
+        new = []
+        for raw in lines:
+            line = raw.strip()
+            if not line:
+                continue
+            if line.startswith("###"):
+                continue
+            bullet = line.startswith(("-", "*", "•"))
+            if bullet:
+                line = line.lstrip("-*• ").strip()
+            if (bullet or line.endswith("?")) and len(line) >= 3:
+                k = line.lower()
+                if k in self._seen:
+                    continue
+                self._seen.add(k)
+                if self._near is not None:
+                    match = self._near.add_if_new(len(self.questions), line)
+                    if match is not None:
+                        self.near_duplicates.append((line, match[1], match[2]))
+                        continue
+                self.questions.append(line)
+                new.append(line)
+        return new
+
+def detect_questions_from_text(text: str, near_threshold: float = None):
+    """
+    Détecte les puces/questions dans un bloc texte IA.
+    Règles: lignes commençant par -, *, • (avec ou sans espace), et/ou finissant par ?.
+    Ignore les titres (### ...). `near_threshold` : écarte aussi les quasi-doublons.
+    """
+    detector = QuestionDetector(near_threshold)
+    detector.feed(text)
+    detector.finish()
+    return detector.questions
+
+# -------- Mode découpé : map-reduce en parallèle sur les longs recueils --------
+AI_CHUNK_CHARS = 12000
+AI_CHUNK_OVERLAP = 800
+AI_MAX_WORKERS = int(os.environ.get("ARBRE_AI_WORKERS", "4"))
+AI_THEMES = ["Chronologie", "Organisation", "Humain", "Technique", "Environnement", "Barrières/Contrôles"]
+AI_OTHER_THEME = "Autres"
+
+def split_text_chunks(text: str, max_chars: int = AI_CHUNK_CHARS, overlap: int = AI_CHUNK_OVERLAP):
+    """
+    Découpe aux limites de paragraphe / ligne de tableau (une ligne = un bloc),
+    en morceaux d'au plus max_chars ; les derniers blocs d'un morceau (jusqu'à
+    `overlap` caractères) sont repris en tête du suivant.
+    """
+    blocks = []
+    for line in text.splitlines():
+        while len(line) > max_chars:   # bloc géant : coupe franche
+            blocks.append(line[:max_chars])
+            line = line[max_chars:]
+        if line.strip():
+            blocks.append(line)
+    chunks, cur, size = [], [], 0
+    for b in blocks:
+        if cur and size + len(b) + 1 > max_chars:
+            chunks.append("\n".join(cur))
+            carry, carry_size = [], 0
+            for prev in reversed(cur):
+                if carry_size + len(prev) + 1 > overlap or carry_size + len(prev) + len(b) + 2 > max_chars:
+                    break
+                carry.insert(0, prev)
+                carry_size += len(prev) + 1
+            cur, size = carry, carry_size
+        cur.append(b)
+        size += len(b) + 1
+    if cur:
+        chunks.append("\n".join(cur))
+    return chunks
+
+def _theme_key(title: str) -> str:
+    t = unicodedata.normalize("NFD", title)
+    return "".join(c for c in t if c.isalnum() and not unicodedata.combining(c)).lower()
+
+_THEME_BY_KEY = {_theme_key(t): t for t in AI_THEMES}
+
+def split_theme_sections(text: str):
+    """Bloc de questions -> [(thème, texte de la section)] (titres Markdown ou **gras**)."""
+    sections, title, body = [], AI_OTHER_THEME, []
+    for raw in text.splitlines():
+        line = raw.strip()
+        heading = None
+        if line.startswith("#"):
+            heading = line.lstrip("#")
+        elif line.startswith("**") and line.rstrip(":").endswith("**"):
+            heading = line.rstrip(":")
+        if heading is not None:
+            if body:
+                sections.append((title, "\n".join(body)))
+            heading = heading.strip(" *:")
+            title = _THEME_BY_KEY.get(_theme_key(heading), heading or AI_OTHER_THEME)
+            body = []
+        else:
+            body.append(raw)
+    if body:
+        sections.append((title, "\n".join(body)))
+    return sections
+
+def merge_question_blocks(blocks, near_threshold: float = NEAR_DUP_THRESHOLD):
+    """
+    Fusion par thème (ordre AI_THEMES puis ordre d'apparition), sans doublons ;
+    les reformulations d'un morceau à l'autre sont écartées (near_threshold, None = exact).
+    """
+    merged = {t: [] for t in AI_THEMES}
+    seen = set()
+    near = NearDuplicateIndex(near_threshold) if near_threshold else None
+    for block in blocks:
+        for title, body in split_theme_sections(block):
+            for q in detect_questions_from_text(body):
+                k = q.lower()
+                if k in seen:
+                    continue
+                seen.add(k)
+                if near is not None and near.add_if_new(len(seen), q) is not None:
+                    continue
+                merged.setdefault(title, []).append(q)
+    out = []
+    for title, qs in merged.items():
+        if not qs:
+            continue
+        out.append(f"### {title}")
+        out.extend(f"- {q}" for q in qs)
+        out.append("")
+    return "\n".join(out).strip()
+
+def ai_questions_chunked(text: str, cache: QuestionCache = None, max_workers: int = AI_MAX_WORKERS,
+                         max_chars: int = AI_CHUNK_CHARS, overlap: int = AI_CHUNK_OVERLAP,
+                         on_warning=None, near_threshold: float = NEAR_DUP_THRESHOLD) -> str:
+    """
+    Map-reduce : un appel par morceau (au plus max_workers en parallèle), chaque
+    morceau repliant sur l'heuristique locale en cas d'échec, puis fusion par thème.
+    `on_warning` est appelé depuis les threads de travail.
+    """
+    chunks = split_text_chunks(text, max_chars, overlap)
+    if len(chunks) <= 1:
+        return ai_questions_only(text, cache=cache, on_warning=on_warning)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+        blocks = list(pool.map(lambda c: ai_questions_only(c, cache=cache, on_warning=on_warning), chunks))
+    return merge_question_blocks(blocks, near_threshold)
+
+# -------- Arbre initial à partir des questions --------
+THEME_CATEGORIES = {
+    "Organisation": "ORGANISATIONNELLE",
+    "Humain": "HUMAINE",
+    "Technique": "TECHNIQUE",
+}
+
+def seed_tree_from_questions(questions_text: str, root_label: str = "Racine") -> TreeStore:
+    """Arbre initial : racine -> un nœud par thème -> une question par nœud."""
+    tree = TreeStore(root_label)
+    seen = set()
+    theme_nodes = {}
+    for title, body in split_theme_sections(questions_text):
+        for q in detect_questions_from_text(body):
+            if q.lower() in seen:
+                continue
+            seen.add(q.lower())
+            cat = THEME_CATEGORIES.get(title)
+            if title not in theme_nodes:
+                theme_nodes[title] = tree.add_node(title, cat, "root")
+            tree.add_node(q, cat, theme_nodes[title])
+    return tree
+
+# =============== RECHERCHE DE NŒUDS (sélecteur paginé) ===============
+_WORD_RE = re.compile(r"\w+")
+
+def label_words(label: str) -> set:
+    """Mots d'un libellé, repliés comme les mots-clés (minuscules, sans accents)."""
+    return set(_WORD_RE.findall(fold_text(label)))
+
+class NodeSearchIndex:
+    """
+    Index des libellés d'un TreeStore pour le sélecteur de nœuds :
+    - mot replié -> ids des nœuds qui le contiennent ;
+    - vocabulaire trié pour la recherche par début de mot (bisect).
+    Tenu à jour par abonnement aux événements de l'arbre (ajout, renommage,
+    suppression, opérations groupées) : aucune reconstruction après une action.
+    """
+
+    def __init__(self, tree: TreeStore):
+        self.tree = tree
+        self._postings = {}     # mot -> set(ids)
+        self._vocab = []        # mots triés
+        self._words = {}        # id -> mots indexés
+        self._seq = {}          # id -> rang d'insertion (ordre des résultats)
+        self._next_seq = 0
+        for nid, data in tree.nodes.items():
+            self._index(nid, data["label"], sort=False)
+        self._vocab = sorted(self._postings)     # un seul tri à la construction
+        tree.subscribe(self._on_change)
+
+    def _index(self, nid: str, label: str, sort: bool = True):
+        if nid not in self._seq:
+            self._seq[nid] = self._next_seq
+            self._next_seq += 1
+        words = label_words(label)
+        self._words[nid] = words
+        for w in words:
+            ids = self._postings.get(w)
+            if ids is None:
+                ids = self._postings[w] = set()
+                if sort:
+                    bisect.insort(self._vocab, w)
+            ids.add(nid)
+
+    def _unindex(self, nid: str):
+        for w in self._words.pop(nid, ()):
+            ids = self._postings[w]
+            ids.discard(nid)
+            if not ids:
+                del self._postings[w]
+                del self._vocab[bisect.bisect_left(self._vocab, w)]
+
+    def _on_change(self, tree, event, payload):
+        for ev, nid in (payload if event == "bulk" else [(event, payload)]):
+            if ev == "move":
+                continue
+            self._unindex(nid)
+            if ev == "delete" or nid not in tree.nodes:
+                self._seq.pop(nid, None)
+            else:
+                self._index(nid, tree.nodes[nid]["label"])
+
+    def _prefix_ids(self, prefix: str) -> set:
+        out = set()
+        i = bisect.bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            out |= self._postings[self._vocab[i]]
+            i += 1
+        return out
+
+    def search(self, query: str = "", subtree: str = None, category: str = None,
+               exclude: str = None, offset: int = 0, limit: int = 50):
+        """
+        (nombre total de résultats, ids de la page demandée). Chaque mot de la
+        requête doit commencer un mot du libellé ; `subtree` restreint à un
+        sous-arbre, `exclude` écarte un sous-arbre (parents sans cycle).
+        """
+        tree = self.tree
+        words = sorted(label_words(query), key=len, reverse=True)   # le plus sélectif d'abord
+        if words:
+            ids = None
+            for w in words:
+                ids = self._prefix_ids(w) if ids is None else ids & self._prefix_ids(w)
+                if not ids:
+                    return 0, []
+            candidates = sorted(ids, key=self._seq.__getitem__)
+        elif subtree is not None:
+            candidates = tree.subtree(subtree)
+        elif category is None and exclude is None:
+            return len(tree.nodes), list(islice(tree.nodes, offset, offset + limit))
+        else:
+            candidates = tree.nodes
+        matched = [
+            nid for nid in candidates
+            if (subtree is None or tree.is_descendant(subtree, nid))
+            and (exclude is None or not tree.is_descendant(exclude, nid))
+            and (category is None or tree.nodes[nid].get("category") == category)
+        ]
+        return len(matched), matched[offset:offset + limit]
+
+# =============== IMPORT D'ARBRE (plan indenté, CSV, JSON) ===============
+_OUTLINE_BULLET = re.compile(r"^(?:[-*•+]|\d+[.)])\s+")
+_OUTLINE_CATEGORY = re.compile(r"\s*[\[(]([^\[\]()]+)[\])]\s*$")
+
+def parse_category(value):
+    """Catégorie de CATEGORIES correspondant à un texte libre (« Humain », « orga »…), sinon None."""
+    v = fold_text(value or "").upper()
+    if not v:
+        return None
+    for cat in CATEGORIES:
+        folded = fold_text(cat).upper()
+        if v == folded or (len(v) >= 3 and folded.startswith(v)):
+            return cat
+    return None
+
+def parse_outline(text: str, tab_size: int = 4):
+    """
+    Plan indenté -> enregistrements d'import. Une ligne par nœud, la profondeur
+    est donnée par l'indentation ; puces (-, *, •, 1.) facultatives ; une
+    catégorie peut suivre entre crochets ou parenthèses : « Cause [Humaine] ».
+    """
+    records = []
+    stack = []      # (indentation, clé)
+    for n, raw in enumerate(text.splitlines()):
+        if not raw.strip():
+            continue
+        expanded = raw.expandtabs(tab_size)
+        indent = len(expanded) - len(expanded.lstrip(" "))
+        label = _OUTLINE_BULLET.sub("", expanded.strip())
+        category = None
+        m = _OUTLINE_CATEGORY.search(label)
+        if m and parse_category(m.group(1)):
+            category = parse_category(m.group(1))
+            label = label[:m.start()].rstrip()
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        parent = stack[-1][1] if stack else None
+        records.append((n, parent, label, category))
+        stack.append((indent, n))
+    return records
+
+def parse_csv(text: str):
+    """
+    CSV (séparateur , ou ;) avec en-tête : id, parent, label, category
+    (alias acceptés : libellé / libelle, catégorie / categorie, parent_id).
+    """
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    aliases = {
+        "id": "id", "parent": "parent", "parent_id": "parent",
+        "label": "label", "libelle": "label", "category": "category", "categorie": "category",
+    }
+    records = []
+    for n, row in enumerate(reader):
+        rec = {}
+        for k, v in row.items():
+            if k is None:
+                continue
+            name = aliases.get(fold_text(k).replace(" ", "_"))
+            if name:
+                rec[name] = (v or "").strip()
+        if not rec.get("label"):
+            continue
+        records.append((rec.get("id") or f"ligne{n}", rec.get("parent") or None,
+                        rec["label"], parse_category(rec.get("category"))))
+    return records
+
+def parse_json_tree(text: str):
+    """
+    JSON imbriqué : {"label", "category", "children": [...]} ou une liste de tels objets.
+    """
+    data = json.loads(text)
+    records = []
+    stack = [(item, None) for item in reversed(data if isinstance(data, list) else [data])]
+    while stack:
+        item, parent = stack.pop()
+        if not isinstance(item, dict) or not str(item.get("label", "")).strip():
+            continue
+        key = len(records)
+        records.append((key, parent, str(item["label"]).strip(), parse_category(item.get("category"))))
+        stack.extend((child, key) for child in reversed(item.get("children") or []))
+    return records
+
+IMPORT_PARSERS = {"outline": parse_outline, "csv": parse_csv, "json": parse_json_tree}
+
+def parse_tree_import(text: str, fmt: str = None):
+    """Enregistrements d'import ; fmt = "outline" / "csv" / "json" (deviné si None)."""
+    if fmt is None:
+        stripped = text.lstrip()
+        if stripped.startswith(("{", "[")):
+            fmt = "json"
+        elif "label" in fold_text(stripped.split("\n", 1)[0]) or "libelle" in fold_text(stripped.split("\n", 1)[0]):
+            fmt = "csv"
+        else:
+            fmt = "outline"
+    return IMPORT_PARSERS[fmt](text)
+
+# =============== PERSISTANCE DES ENQUÊTES (SQLite) ===============
+INVESTIGATION_DB_PATH = os.environ.get("ARBRE_DB", os.path.join(".arbre_data", "enquetes.sqlite"))
+INVESTIGATION_FIELDS = ("title", "root_label", "why_problem", "why", "ai_doc_text", "ai_questions_text")
+
+class InvestigationDB:
+    """
+    Enquêtes enregistrées : une ligne par enquête (champs texte, 5 Pourquoi en JSON)
+    et une ligne par nœud (libellé, catégorie, parent, rang du lien).
+    Après la création, chaque ajout / déplacement / renommage est une écriture
+    d'une seule ligne (voir `attach`). La liste des enquêtes est paginée et
+    le chargement d'une enquête ne lit que ses propres lignes.
+    """
+
+    def __init__(self, path: str = INVESTIGATION_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS investigations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                root_label TEXT NOT NULL DEFAULT 'Racine',
+                why_problem TEXT NOT NULL DEFAULT '',
+                why TEXT NOT NULL DEFAULT '[]',
+                ai_doc_text TEXT NOT NULL DEFAULT '',
+                ai_questions_text TEXT NOT NULL DEFAULT '',
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS investigations_updated ON investigations(updated);
+            CREATE TABLE IF NOT EXISTS nodes (
+                inv_id INTEGER NOT NULL REFERENCES investigations(id) ON DELETE CASCADE,
+                node_id TEXT NOT NULL,
+                label TEXT NOT NULL,
+                category TEXT,
+                parent_id TEXT,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (inv_id, node_id)
+            );
+            CREATE INDEX IF NOT EXISTS nodes_seq ON nodes(inv_id, seq);
+            """
+        )
+        self._db.commit()
+
+    # ---- enquêtes ----
+    def create(self, title: str, tree: TreeStore = None, **fields) -> int:
+        """Nouvelle enquête ; écrit l'arbre fourni en une seule transaction."""
+        tree = tree or TreeStore()
+        now = time.time()
+        values = {k: v for k, v in fields.items() if k in INVESTIGATION_FIELDS}
+        values["title"] = title
+        values.setdefault("root_label", tree.label("root"))
+        if "why" in values:
+            values["why"] = json.dumps(values["why"], ensure_ascii=False)
+        cols = ", ".join(values)
+        marks = ", ".join("?" for _ in values)
+        with self._lock:
+            cur = self._db.execute(
+                f"INSERT INTO investigations ({cols}, created, updated) VALUES ({marks}, ?, ?)",
+                (*values.values(), now, now),
+            )
+            inv_id = cur.lastrowid
+            # préordre : parents avant enfants, ordre des frères conservé
+            rows = [
+                (inv_id, nid, tree.nodes[nid]["label"], tree.nodes[nid].get("category"), tree.parent(nid), seq)
+                for seq, nid in enumerate(tree.subtree("root"))
+            ]
+            self._db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+        return inv_id
+
+    @staticmethod
+    def _title_filter(query: str):
+        """(clause WHERE, paramètres) : titre contenant `query` (LIKE échappé)."""
+        query = (query or "").strip()
+        if not query:
+            return "", ()
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return " WHERE title LIKE ? ESCAPE '\\'", (pattern,)
+
+    def list_recent(self, limit: int = 50, offset: int = 0, query: str = None):
+        """[(id, titre, date de mise à jour)] du plus récent au plus ancien (titre contenant `query`)."""
+        where, params = self._title_filter(query)
+        with self._lock:
+            return self._db.execute(
+                f"SELECT id, title, updated FROM investigations{where} ORDER BY updated DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+
+    def count(self, query: str = None) -> int:
+        """Nombre d'enquêtes (titre contenant `query`)."""
+        where, params = self._title_filter(query)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM investigations{where}", params).fetchone()[0]
+
+    def load(self, inv_id: int) -> dict:
+        """Champs de l'enquête + arbre reconstruit (None si l'enquête n'existe pas)."""
+        with self._lock:
+            cur = self._db.execute(
+                f"SELECT {', '.join(INVESTIGATION_FIELDS)} FROM investigations WHERE id = ?", (inv_id,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            node_rows = self._db.execute(
+                "SELECT node_id, label, category, parent_id FROM nodes WHERE inv_id = ? ORDER BY seq",
+                (inv_id,),
+            ).fetchall()
+        data = dict(zip(INVESTIGATION_FIELDS, row))
+        data["why"] = json.loads(data["why"])
+        # reconstruction parents d'abord d'après parent_id : un nœud déplacé reçoit
+        # un seq supérieur à ceux de ses enfants, seq ne sert qu'à l'ordre des frères
+        tree = TreeStore(data["root_label"])
+        by_parent = defaultdict(list)
+        for node_id, label, category, parent_id in node_rows:
+            if node_id == "root":
+                tree.relabel("root", label)
+            else:
+                by_parent[parent_id].append((node_id, label, category))
+        queue = deque([("root", by_parent.pop("root", ()))])
+        while queue:
+            parent_id, children = queue.popleft()
+            for node_id, label, category in children:
+                tree.add_node(label, category, parent_id, node_id=node_id)
+                queue.append((node_id, by_parent.pop(node_id, ())))
+        orphans = sum(len(rows) for rows in by_parent.values())
+        if orphans:
+            logger.warning("Enquête %s : %d nœud(s) sans parent valide ignoré(s).", inv_id, orphans)
+        data["tree"] = tree
+        return data
+
+    def update_fields(self, inv_id: int, **fields):
+        values = {k: v for k, v in fields.items() if k in INVESTIGATION_FIELDS}
+        if not values:
+            return
+        if "why" in values:
+            values["why"] = json.dumps(values["why"], ensure_ascii=False)
+        sets = ", ".join(f"{k} = ?" for k in values)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE investigations SET {sets}, updated = ? WHERE id = ?",
+                (*values.values(), time.time(), inv_id),
+            )
+            self._db.commit()
+
+    def delete(self, inv_id: int):
+        with self._lock:
+            self._db.execute("DELETE FROM nodes WHERE inv_id = ?", (inv_id,))
+            self._db.execute("DELETE FROM investigations WHERE id = ?", (inv_id,))
+            self._db.commit()
+
+    # ---- écritures incrémentales de l'arbre ----
+    def attach(self, tree: TreeStore, inv_id: int):
+        """
+        Abonne l'enquête aux modifications de l'arbre : une ligne écrite par action,
+        une seule transaction pour une opération groupée.
+        """
+        def _apply(t, event, node_id):
+            if event == "delete":
+                self._db.execute("DELETE FROM nodes WHERE inv_id = ? AND node_id = ?", (inv_id, node_id))
+                return
+            data = t.nodes.get(node_id)
+            if data is None:    # ajouté puis supprimé dans la même opération groupée
+                return
+            if event == "add":
+                self._db.execute(
+                    "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?,"
+                    " (SELECT COALESCE(MAX(seq), 0) + 1 FROM nodes WHERE inv_id = ?))",
+                    (inv_id, node_id, data["label"], data.get("category"), t.parent(node_id), inv_id),
+                )
+            elif event == "move":
+                self._db.execute(
+                    "UPDATE nodes SET parent_id = ?,"
+                    " seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM nodes WHERE inv_id = ?)"
+                    " WHERE inv_id = ? AND node_id = ?",
+                    (t.parent(node_id), inv_id, inv_id, node_id),
+                )
+            elif event == "relabel":
+                self._db.execute(
+                    "UPDATE nodes SET label = ?, category = ? WHERE inv_id = ? AND node_id = ?",
+                    (data["label"], data.get("category"), inv_id, node_id),
+                )
+
+        def _on_change(t, event, payload):
+            with self._lock:
+                if event == "bulk":
+                    for ev, node_id in payload:
+                        _apply(t, ev, node_id)
+                else:
+                    _apply(t, event, payload)
+                self._db.execute("UPDATE investigations SET updated = ? WHERE id = ?", (time.time(), inv_id))
+                self._db.commit()
+        tree.subscribe(_on_change)
@@ -0,0 +1,144 @@
+# fichier: arbre_des_causes_llm_stub.py
+"""
+Serveur local imitant l'API OpenAI (POST /v1/chat/completions, flux SSE) pour
+essayer hors ligne le client partagé, la file d'attente et les nouvelles
+tentatives. La réponse est le bloc de l'heuristique locale appliquée au dernier
+message utilisateur, envoyé mot par mot, suivi d'un morceau `usage`.
+
+Options utiles : --latency (attente avant le premier morceau), --chunk-delay
+(entre deux morceaux) et --fail-rate (part des requêtes refusées en 429 avec
+Retry-After) pour observer la limitation de débit.
+
+Exemple :
+    python arbre_des_causes_llm_stub.py --port 8765 --fail-rate 0.2
+    OPENAI_API_KEY=stub ARBRE_AI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run arbre_des_causes_app.py
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from arbre_des_causes_core import heuristic_questions_text
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # connexions persistantes (pool du client)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, payload: dict, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        chunk = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                self._send_json(404, {"error": {"message": f"chemin inconnu : {self.path}"}})
+                return
+            if server.rng.random() < server.fail_rate:
+                with server.lock:
+                    server.rejected += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                                {"Retry-After": str(server.retry_after)})
+                return
+            prompt = next((m.get("content", "") for m in reversed(request.get("messages", []))
+                           if m.get("role") == "user"), "")
+            answer = heuristic_questions_text(prompt)
+            model = request.get("model", "stub")
+            base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            time.sleep(server.latency)
+            if not request.get("stream"):
+                self._send_json(200, {
+                    **base, "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                    "usage": _usage(prompt, answer),
+                })
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in re.findall(r"\S+\s*|\s+", answer):
+                self._send_event({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                time.sleep(server.chunk_delay)
+            self._send_event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._send_event({**base, "choices": [], "usage": _usage(prompt, answer)})
+            self._send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            with server.lock:
+                server.active -= 1
+
+def _usage(prompt: str, answer: str) -> dict:
+    """Comptage grossier (un jeton ≈ 4 caractères)."""
+    p, c = len(prompt) // 4 + 1, len(answer) // 4 + 1
+    return {"prompt_tokens": p, "completion_tokens": c, "total_tokens": p + c}
+
+def serve(port: int = 0, latency: float = 0.0, chunk_delay: float = 0.0, fail_rate: float = 0.0,
+          retry_after: float = 1.0, seed: int = None, verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    Démarre le serveur dans un fil d'arrière-plan (port 0 = port libre) et le renvoie :
+    base_url = f"http://127.0.0.1:{server.server_port}/v1" ; arrêt par server.shutdown().
+    Compteurs : requests, rejected, max_active (requêtes simultanées observées).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency, server.chunk_delay = latency, chunk_delay
+    server.fail_rate, server.retry_after = fail_rate, retry_after
+    server.rng = random.Random(seed)
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = server.rejected = server.active = server.max_active = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serveur local compatible OpenAI (essais hors ligne).")
+    parser.add_argument("--port", type=int, default=8765, help="Port d'écoute (127.0.0.1)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Attente avant le premier morceau (s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Attente entre deux morceaux (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Part des requêtes refusées en 429 (0 à 1)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="En-tête Retry-After des refus (s)")
+    parser.add_argument("--seed", type=int, default=None, help="Graine des refus aléatoires")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Journaliser chaque requête")
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, args.latency, args.chunk_delay, args.fail_rate, args.retry_after, args.seed, args.verbose)
+    print(f"Serveur prêt : OPENAI_API_KEY=stub ARBRE_AI_BASE_URL=http://127.0.0.1:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"{server.requests} requête(s), {server.rejected} refusée(s), {server.max_active} simultanée(s) au plus.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())